@@ -0,0 +1,163 @@
+"""
+This module contains indexes of the addresses of a DVF frame, for the
+search boxes of the real estate apps.
+
+build_street_index indexes the street names of a frame once, so that
+search_streets finds the rows of a street without scanning the frame.
+Likewise, build_label_index and search_labels find properties by the
+beginning of their address.
+"""
+
+from collections import defaultdict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+NGRAM_SIZE = 3  # Length of the street name pieces indexed
+
+# Street names of a frame (see build_street_index)
+StreetIndex = namedtuple("StreetIndex", ["names", "postings", "rows"])
+
+MAX_MATCHES = 50  # Labels returned by search_labels
+
+# Sorted address labels of a frame (see build_label_index)
+LabelIndex = namedtuple("LabelIndex", ["keys", "labels", "positions"])
+
+
+def _ngrams(text, n=NGRAM_SIZE):
+    """Return the set of substrings of length n of a text."""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def build_street_index(df, column="adresse_nom_voie"):
+    """
+    Index the street names of a frame for case-insensitive substring
+    search.
+
+    Each distinct name is cut into pieces of NGRAM_SIZE characters, and
+    each piece points to the names containing it. Each name points to
+    the positions of its rows in df.
+
+    Parameters:
+    -----------
+    df: pd.DataFrame
+        The data (not modified).
+    column: str
+        The column with the street names.
+
+    Returns:
+    --------
+    index: StreetIndex
+        The lowercase distinct names, the postings (piece -> ids of the
+        names containing it) and the rows (name id -> positions in df).
+    """
+    codes, uniques = pd.factorize(df[column])
+    names = [str(name).lower() for name in uniques]
+
+    postings = defaultdict(list)
+    for name_id, name in enumerate(names):
+        for gram in _ngrams(name):
+            postings[gram].append(name_id)
+
+    # Group the row positions by name (rows without a name have code -1)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+    rows = [order[bounds[i]:bounds[i + 1]] for i in range(len(names))]
+
+    return StreetIndex(names, dict(postings), rows)
+
+
+def search_streets(index, text):
+    """
+    Return the positions of the rows whose street name contains text,
+    ignoring case.
+
+    Parameters:
+    -----------
+    index: StreetIndex
+        The index built with build_street_index.
+    text: str
+        The text to look for.
+
+    Returns:
+    --------
+    positions: np.ndarray
+        The positions of the matching rows, in the order of the frame.
+    """
+    text = text.lower()
+    grams = _ngrams(text)
+    if grams:
+        # Only the names containing every piece of text can match
+        candidates = set.intersection(*(
+            set(index.postings.get(gram, ())) for gram in grams
+            ))
+    else:
+        # Text shorter than a piece: the distinct names are few
+        candidates = range(len(index.names))
+
+    matches = [
+        index.rows[name_id] for name_id in candidates
+        if text in index.names[name_id]
+        ]
+    if not matches:
+        return np.empty(0, dtype=np.intp)
+    return np.sort(np.concatenate(matches))
+
+
+def build_label_index(df):
+    """
+    Index the properties of a frame by a label made of their address and
+    date of sale, e.g. "12 RUE DE RIVOLI (2022-03-01)".
+
+    Parameters:
+    -----------
+    df: pd.DataFrame
+        The data (not modified).
+
+    Returns:
+    --------
+    index: LabelIndex
+        The distinct labels sorted by their lowercase version (the keys),
+        and the position in df of the first row with each label.
+    """
+    number = df["adresse_numero"].astype("Int64").astype(str)
+    street = df["adresse_nom_voie"].astype(object).fillna("").astype(str)
+    labels = (
+        number.fillna("").replace("<NA>", "") + " " +
+        street + " (" +
+        df["date_mutation"].astype(str) + ")"
+    ).str.strip().to_numpy(dtype=str)
+
+    labels, positions = np.unique(labels, return_index=True)
+    keys = np.char.lower(labels)
+    order = np.argsort(keys, kind="stable")
+    return LabelIndex(keys[order], labels[order], positions[order])
+
+
+def search_labels(index, text, limit=MAX_MATCHES):
+    """
+    Return the labels starting with text (ignoring case), in order.
+
+    Parameters:
+    -----------
+    index: LabelIndex
+        The index built with build_label_index.
+    text: str
+        The beginning of the label.
+    limit: int
+        The maximum number of labels returned.
+
+    Returns:
+    --------
+    labels: np.ndarray
+        The matching labels.
+    positions: np.ndarray
+        The position in the frame of the row of each label.
+    """
+    text = text.lower()
+    # The keys starting with text are between text and text + the
+    # largest character
+    start = np.searchsorted(index.keys, text)
+    end = np.searchsorted(index.keys, text + chr(0x10FFFF))
+    end = min(end, start + limit)
+    return index.labels[start:end], index.positions[start:end]
@@ -3,14 +3,21 @@ Base example for a streamlit app.
 Simply display the raw data.
 """
 
-import pandas as pd
+import os
+import sys
+
 import streamlit as st
 
+# dvf.py is at the root of the repository (see "Shared code" in the README)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+from dvf import read_dvf  # noqa: E402
+
 FILE = (
     "https://files.data.gouv.fr/geo-dvf/latest/csv/2022/"
     "departements/75.csv.gz"
 )
-df = pd.read_csv(FILE, compression="gzip", low_memory=False)
+df = read_dvf(FILE)
 st.title("Real estate prices in France")
 
 st.header("Raw data")
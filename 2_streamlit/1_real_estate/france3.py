@@ -1,30 +1,47 @@
-import pandas as pd
+import os
+import sys
+
 import streamlit as st
 
+# dvf.py is at the root of the repository (see "Shared code" in the README)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+from dvf import read_dvf  # noqa: E402
+from address_index import build_label_index, search_labels  # noqa: E402
+
 
 @st.cache_data
 def load_data(url):
     """Load and cache data from URL."""
-    return pd.read_csv(url, compression="gzip", low_memory=False)
+    return read_dvf(url)
+
 
+@st.cache_resource
+def get_label_index(file, only_sales, _df):
+    """Index the address labels of the data once, for all the reruns."""
+    return build_label_index(_df)
 
-def display_property_info(df):
+
+def display_property_info(df, label_index):
     """Display info about a selected individual property."""
     st.header("Individual Property Search")
 
-    # Unique label combining number + street + date
-    df['display_name'] = (
-        df['adresse_numero'].astype(str) + " " +
-        df['adresse_nom_voie'] + " (" +
-        df['date_mutation'] + ")"
-    )
+    # Only the first matches of the search are offered, so the widget
+    # stays small even for large departments
+    search = st.text_input("Search by address (e.g. 12 RUE DE RIVOLI):", "")
+    labels, positions = search_labels(label_index, search)
+    if len(labels) == 0:
+        st.write("No property matches this address.")
+        return
 
-    selected_label = st.selectbox(
+    # Labels combine number + street + date
+    choice = st.selectbox(
         "Select a property to view details:",
-        df['display_name'].unique()
+        range(len(labels)),
+        format_func=lambda i: labels[i]
     )
 
-    property_details = df[df['display_name'] == selected_label].iloc[0]
+    property_details = df.iloc[positions[choice]]
 
     col1, col2 = st.columns(2)
     with col1:
@@ -66,15 +83,15 @@ def get_sidebar_and_data():
     median_price = df["valeur_fonciere"].median()
     st.sidebar.write(f"Median price: {median_price:.0f} €")
 
-    return df, year
+    return df, year, get_label_index(file, only_sales, df)
 
 
 def main():
     st.title("Real estate prices in France")
 
-    df, year = get_sidebar_and_data()
+    df, year, label_index = get_sidebar_and_data()
 
-    display_property_info(df)
+    display_property_info(df, label_index)
     display_table(df, year)
 
 
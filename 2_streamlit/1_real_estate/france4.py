@@ -3,9 +3,28 @@ This is the third step of the Streamlit tutorial.
 We will add a selectbox to choose the year.
 """
 
-import pandas as pd
+import os
+import sys
+
 import streamlit as st
 
+# dvf.py is at the root of the repository (see "Shared code" in the README)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+from dvf import get_version, read_dvf  # noqa: E402
+from address_index import build_street_index, search_streets  # noqa: E402
+
+
+@st.cache_resource
+def get_street_index(file, version, _df):
+    """
+    Index the street names of a file once, for all the reruns.
+
+    The version of the file (see get_version) is part of the key, so the
+    positions of the index always point into the current _df.
+    """
+    return build_street_index(_df)
+
 st.title("Real estate prices in France")
 
 # ADDITION: Let's move year selection to a sidebar
@@ -22,7 +41,9 @@ FILE = (
     f"https://files.data.gouv.fr/geo-dvf/latest/csv/{year}/"
     f"departements/{department}.csv.gz"
 )
-df = pd.read_csv(FILE, compression="gzip", low_memory=False)
+# Changes when the file is downloaded again (for the cached results)
+version = get_version(FILE)
+df = read_dvf(FILE)
 
 # ADDITION: Why not add the median price of the department to this sidebar?
 median_price = df["valeur_fonciere"].median()
@@ -37,8 +58,9 @@ only_sales = st.checkbox("Exclude non-sale transactions")
 street_name = st.text_input("Filter by street name", "")
 
 if street_name:
-    df.dropna(subset=["adresse_nom_voie"], inplace=True)
-    df = df[df["adresse_nom_voie"].str.contains(street_name, case=False)]
+    # The street names are indexed, the frame is not scanned
+    index = get_street_index(FILE, version, df)
+    df = df.iloc[search_streets(index, street_name)]
 
 if only_sales:
     df = df[df["nature_mutation"] == "Vente"]
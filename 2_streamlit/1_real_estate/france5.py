@@ -3,9 +3,69 @@ This is the fifth step of the Streamlit tutorial.
 We will add a tab to display statistics.
 """
 
-import pandas as pd
+import os
+import sys
+
 import streamlit as st
 
+# dvf.py is at the root of the repository (see "Shared code" in the README)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+from dvf import get_version, read_dvf  # noqa: E402
+from address_index import build_street_index, search_streets  # noqa: E402
+
+MAX_CACHED_STATS = 20  # (file, version, sales filter) whose stats are kept
+
+
+@st.cache_resource
+def get_street_index(file, version, _df):
+    """
+    Index the street names of a file once, for all the reruns.
+
+    The version of the file (see get_version) is part of the key, so the
+    positions of the index always point into the current _df.
+    """
+    return build_street_index(_df)
+
+
+def compute_stats(df):
+    """
+    Compute the statistics of the Stats tab.
+
+    Returns:
+    --------
+    summary: pd.DataFrame
+        The summary statistics of the price, surface and rooms.
+    by_rooms: pd.DataFrame
+        The median price and surface per number of rooms.
+    """
+    filtered_df = df[[
+        "valeur_fonciere",
+        "surface_reelle_bati",
+        "nombre_pieces_principales"
+        ]]
+    filtered_df = filtered_df.dropna()
+    summary = filtered_df.describe().transpose().drop(["count", "std"], axis=1)
+
+    # Both medians per number of rooms, in a single aggregation
+    by_rooms = filtered_df.groupby("nombre_pieces_principales")\
+        .median()\
+        .reset_index()
+    return summary, by_rooms
+
+
+@st.cache_data(max_entries=MAX_CACHED_STATS)
+def get_stats(file, version, only_sales, _df):
+    """
+    Compute the statistics of the Stats tab once per file (and version
+    of the file, see get_version) and sales filter.
+
+    The street searches are not cached: each letter typed would add an
+    entry.
+    """
+    return compute_stats(_df)
+
+
 st.title("Real estate prices in France")
 
 year = st.sidebar.selectbox(
@@ -19,7 +79,9 @@ FILE = (
     f"https://files.data.gouv.fr/geo-dvf/latest/csv/{year}/"
     f"departements/{department}.csv.gz"
 )
-df = pd.read_csv(FILE, compression="gzip", low_memory=False)
+# Changes when the file is downloaded again (for the cached results)
+version = get_version(FILE)
+df = read_dvf(FILE)
 
 median_price = df["valeur_fonciere"].median()
 st.sidebar.write(f"Median price: {median_price:.0f} €")
@@ -40,8 +102,9 @@ with tab_table:
     street_name = st.text_input("Filter by street name", "")
 
     if street_name:
-        df.dropna(subset=["adresse_nom_voie"], inplace=True)
-        df = df[df["adresse_nom_voie"].str.contains(street_name, case=False)]
+        # The street names are indexed, the frame is not scanned
+        index = get_street_index(FILE, version, df)
+        df = df.iloc[search_streets(index, street_name)]
 
     if only_sales:
         df = df[df["nature_mutation"] == "Vente"]
@@ -53,43 +116,25 @@ with tab_table:
 # ADDITION: We add a new tab for statistics
 
 with tab_stats:
+    # The statistics are computed once per file and sales filter, so
+    # changing the radio button below only reads them
+    if street_name:
+        stats = compute_stats(df)
+    else:
+        stats = get_stats(FILE, version, only_sales, df)
     st.header("Statistics")
-    filtered_df = df[[
-        "valeur_fonciere",
-        "surface_reelle_bati",
-        "nombre_pieces_principales"
-        ]]
-    filtered_df = filtered_df.dropna()
-    st.write(filtered_df.describe().transpose().drop(["count", "std"], axis=1))
+    summary, by_rooms = stats
+    st.write(summary)
 
     st.header("Bar charts")
 
     # Add radio button to select between price and surface
     price_or_surface = st.radio("Price or surface", ["price", "surface"])
 
-    if price_or_surface == "price":
-        # Display a bar chart with average price per number of rooms
-        bar_data = filtered_df[[
-            "nombre_pieces_principales",
-            "valeur_fonciere"
-            ]].groupby("nombre_pieces_principales")\
-            .median()\
-            .reset_index()
-        st.bar_chart(
-            bar_data,
-            x="nombre_pieces_principales",
-            y="valeur_fonciere"
-            )
-    else:
-        # Display a bar chart with average surface per number of rooms
-        bar_data = filtered_df[[
-            "nombre_pieces_principales",
-            "surface_reelle_bati"
-            ]].groupby("nombre_pieces_principales")\
-            .median()\
-            .reset_index()
-        st.bar_chart(
-            bar_data,
-            x="nombre_pieces_principales",
-            y="surface_reelle_bati"
-            )
+    # The medians are already computed, the chart only picks a column
+    st.bar_chart(
+        by_rooms,
+        x="nombre_pieces_principales",
+        y="valeur_fonciere" if price_or_surface == "price"
+        else "surface_reelle_bati"
+        )
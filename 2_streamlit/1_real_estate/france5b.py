@@ -4,9 +4,16 @@ We will add a tab to display statistics.
 (This shows an alternative way of dealing with tabs)
 """
 
-import pandas as pd
+import os
+import sys
+
 import streamlit as st
 
+# dvf.py is at the root of the repository (see "Shared code" in the README)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+from dvf import read_dvf  # noqa: E402
+
 st.title("Real estate prices in France")
 
 year = st.sidebar.selectbox(
@@ -20,7 +27,7 @@ FILE = (
     f"https://files.data.gouv.fr/geo-dvf/latest/csv/{year}/"
     f"departements/{department}.csv.gz"
 )
-df = pd.read_csv(FILE, compression="gzip", low_memory=False)
+df = read_dvf(FILE)
 
 median_price = df["valeur_fonciere"].median()
 st.sidebar.write(f"Median price: {median_price:.0f} €")
@@ -3,12 +3,26 @@ This is the sixth step of the Streamlit tutorial.
 We structure the code into functions
 """
 
-import pandas as pd
+import os
+import sys
+
+import numpy as np
 import pydeck as pdk  # ADDITION: Import PyDeck (neccessary for the map)
 import streamlit as st
 
+# dvf.py is at the root of the repository (see "Shared code" in the README)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+from dvf import get_url, get_version, load_dvf, load_many  # noqa: E402
+from address_index import build_street_index, search_streets  # noqa: E402
+from sketch import QuantileSketch, merge_sketches  # noqa: E402
+
+COORD_DECIMALS = 5  # Precision of the coordinates sent to the map
+MAX_CACHED = 10  # Selections whose stats, map data and index are kept
+GRID_CELL = 0.005  # Size of the cells of the map grid, in degrees
+
 
-def display_table(df):
+def display_table(df, street_index):
     """Display the table tab."""
     st.header("Raw data")
     st.write("Streamlit app to display real estate prices in **Paris**")
@@ -18,8 +32,8 @@ def display_table(df):
     street_name = st.text_input("Filter by street name", "")
 
     if street_name:
-        df.dropna(subset=["adresse_nom_voie"], inplace=True)
-        df = df[df["adresse_nom_voie"].str.contains(street_name, case=False)]
+        # The street names are indexed, the frame is not scanned
+        df = df.iloc[search_streets(street_index, street_name)]
 
     if only_sales:
         df = df[df["nature_mutation"] == "Vente"]
@@ -28,57 +42,126 @@ def display_table(df):
 
     st.write(f"Number of rows: {df.shape[0]}")
 
+    return only_sales
 
-def display_tab_stats(df):
-    """Display the statistics tab."""
-    st.header("Statistics")
-    filtered_df = df[[
+
+@st.cache_data(max_entries=MAX_CACHED)
+def get_stats(years, departments, versions, only_sales, _df):
+    """
+    Compute the statistics of the Stats tab once per selection (and
+    versions of the files, see get_version).
+
+    Returns:
+    --------
+    summary: pd.DataFrame
+        The summary statistics of the price, surface and rooms.
+    by_rooms: pd.DataFrame
+        The median price and surface per number of rooms.
+    """
+    if only_sales:
+        _df = _df[_df["nature_mutation"] == "Vente"]
+    filtered_df = _df[[
         "valeur_fonciere",
         "surface_reelle_bati",
         "nombre_pieces_principales"
         ]]
     filtered_df = filtered_df.dropna()
-    st.write(
-        filtered_df.describe().transpose().drop(["count", "std"], axis=1)
-        )
+    summary = filtered_df.describe().transpose().drop(["count", "std"], axis=1)
+
+    # Both medians per number of rooms, in a single aggregation
+    by_rooms = filtered_df.groupby("nombre_pieces_principales")\
+        .median()\
+        .reset_index()
+    return summary, by_rooms
+
+
+def display_tab_stats(stats):
+    """Display the statistics tab, from the results of get_stats."""
+    st.header("Statistics")
+    summary, by_rooms = stats
+    st.write(summary)
 
     st.header("Bar charts")
 
     # Add radio button to select between price and surface
     price_or_surface = st.radio("Price or surface", ["price", "surface"])
 
-    if price_or_surface == "price":
-        # Display a bar chart with average price per number of rooms
-        bar_data = filtered_df[[
-            "nombre_pieces_principales",
-            "valeur_fonciere"
-            ]].groupby("nombre_pieces_principales")\
-              .median()\
-              .reset_index()
-        st.bar_chart(
-            bar_data,
-            x="nombre_pieces_principales",
-            y="valeur_fonciere"
-            )
-    else:
-        # Display a bar chart with average surface per number of rooms
-        bar_data = filtered_df[[
-            "nombre_pieces_principales",
-            "surface_reelle_bati"
-            ]].groupby("nombre_pieces_principales")\
-              .median()\
-              .reset_index()
-        st.bar_chart(
-            bar_data,
-            x="nombre_pieces_principales",
-            y="surface_reelle_bati"
-            )
+    # The medians are already computed, the chart only picks a column
+    st.bar_chart(
+        by_rooms,
+        x="nombre_pieces_principales",
+        y="valeur_fonciere" if price_or_surface == "price"
+        else "surface_reelle_bati"
+        )
 
 
-def display_tab_map(df):
+@st.cache_data(max_entries=MAX_CACHED)
+def get_map_points(years, departments, versions, _df):
+    """
+    Return only what the map layer draws: the coordinates, rounded to
+    about one meter (5 decimals) so that they are short in JSON.
+    """
+    points = _df[["longitude", "latitude"]].dropna()
+    return points.round(COORD_DECIMALS).reset_index(drop=True)
+
+
+@st.cache_data(max_entries=MAX_CACHED)
+def get_map_grid(years, departments, versions, _df, cell=GRID_CELL):
+    """
+    Aggregate the properties into square cells of cell degrees, on the
+    server, so that the map receives one row per cell instead of one per
+    property.
+    """
+    points = _df[["longitude", "latitude", "valeur_fonciere"]].dropna(
+        subset=["longitude", "latitude"]
+        )
+    keys = [
+        np.floor(points["longitude"] / cell),
+        np.floor(points["latitude"] / cell),
+    ]
+    grid = points.groupby(keys).agg(
+        count=("valeur_fonciere", "size"),
+        median_price=("valeur_fonciere", "median"),
+    )
+    # Place each cell at its center
+    grid["longitude"] = (grid.index.get_level_values(0) + 0.5) * cell
+    grid["latitude"] = (grid.index.get_level_values(1) + 0.5) * cell
+    return grid.reset_index(drop=True).round(COORD_DECIMALS)
+
+
+def display_tab_map(df, years, departments, versions):
     """Display the map tab."""
 
     st.header("Map of all properties")
+
+    # Every property, or one column per cell of the grid
+    aggregate = st.radio("Display", ["Properties", "Grid"]) == "Grid"
+
+    if aggregate:
+        data = get_map_grid(years, departments, versions, df)
+        layer = pdk.Layer(
+            "ColumnLayer",
+            data=data,
+            get_position=["longitude", "latitude"],
+            get_elevation="count",
+            elevation_scale=10,
+            radius=GRID_CELL * 111_000 / 2,  # In meters
+            get_fill_color=[200, 30, 0, 160],
+            extruded=True,
+            pickable=True,
+        )
+        tooltip = {"text": "{count} properties\nMedian price: {median_price} €"}
+    else:
+        data = get_map_points(years, departments, versions, df)
+        layer = pdk.Layer(
+            "ScatterplotLayer",
+            data=data,
+            get_position=["longitude", "latitude"],
+            get_color=[200, 30, 0, 160],
+            get_radius=50,
+        )
+        tooltip = None
+
     st.pydeck_chart(
         pdk.Deck(
             map_style="mapbox://styles/mapbox/light-v9",
@@ -88,38 +171,63 @@ def display_tab_map(df):
                 zoom=10,
                 pitch=50,
             ),
-            layers=[
-
-                pdk.Layer(
-                    "ScatterplotLayer",
-                    data=df,
-                    get_position=["longitude", "latitude"],
-                    get_color=[200, 30, 0, 160],
-                    get_radius=50,
-                ),
-            ],
+            layers=[layer],
+            tooltip=tooltip,
         )
     )
 
 
+@st.cache_resource
+def get_price_sketch(year, department, version):
+    """
+    Summarise the prices of one file once per version of the file (see
+    get_version), for all the reruns.
+
+    The returned sketch is shared: do not modify it (merging is fine).
+    """
+    prices = load_dvf(year, department, columns=["valeur_fonciere"])
+    return QuantileSketch.from_values(prices["valeur_fonciere"])
+
+
+@st.cache_resource(max_entries=MAX_CACHED)
+def get_street_index(years, departments, versions, _df):
+    """
+    Index the street names of the data once, for all the reruns.
+
+    The versions of the files (see get_version) are part of the key, so
+    the positions of the index always point into the current _df.
+    """
+    return build_street_index(_df)
+
+
 def get_sidebar_and_data():
     """Get the sidebar and load data based on the user's input."""
-    year = st.sidebar.selectbox(
-        "Year to display:",
-        [2020, 2021, 2022, 2023, 2024]
+    # Several years and departments can be displayed together
+    years = st.sidebar.multiselect(
+        "Years to display:",
+        [2020, 2021, 2022, 2023, 2024],
+        default=[2020]
         )
 
-    department = st.sidebar.selectbox(
-        "Department to display:",
-        [75, 92, 93, 94]
+    departments = st.sidebar.multiselect(
+        "Departments to display:",
+        [75, 92, 93, 94],
+        default=[75]
         )
 
-    file = (
-        f"https://files.data.gouv.fr/geo-dvf/latest/csv/{year}/"
-        f"departements/{department}.csv.gz"
-    )
-    df = pd.read_csv(file, compression="gzip", low_memory=False)
-    return df
+    if not years or not departments:
+        st.warning("Select at least one year and one department.")
+        st.stop()
+
+    # The files are loaded in parallel
+    df = load_many(years, departments)
+    # (year, department, version) of each file: the versions change when
+    # a file is downloaded again, which invalidates the cached results
+    versions = tuple(
+        (year, department, get_version(get_url(year, department)))
+        for year in years for department in departments
+        )
+    return years, departments, versions, df
 
 
 def main():
@@ -127,21 +235,29 @@ def main():
 
     st.title("Real estate prices in France")
 
-    df = get_sidebar_and_data()
+    years, departments, versions, df = get_sidebar_and_data()
+    street_index = get_street_index(years, departments, versions, df)
 
-    median_price = df["valeur_fonciere"].median()
-    st.sidebar.write(f"Median price: {median_price:.0f} €")
+    # The median is read from the merged sketches of the selected files,
+    # not computed from the rows
+    prices = merge_sketches(
+        get_price_sketch(year, department, version)
+        for year, department, version in versions
+        )
+    st.sidebar.write(f"Median price: {prices.median():.0f} €")
 
     tab_stats, tab_table, tab_map = st.tabs(["Stats", "Table", "Map"])
 
     with tab_table:
-        display_table(df)
+        only_sales = display_table(df, street_index)
 
     with tab_stats:
-        display_tab_stats(df)
+        display_tab_stats(
+            get_stats(years, departments, versions, only_sales, df)
+            )
 
     with tab_map:
-        display_tab_map(df)
+        display_tab_map(df, years, departments, versions)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+"""
+This module contains a mergeable quantile sketch (KLL), to compute the
+median price of a selection of (year, department) files without reading
+their rows again.
+
+Each file is summarised once by a QuantileSketch of a few hundred
+values. The sketches of several files can then be merged, and the merged
+sketch answers median and percentile queries for all their rows
+together.
+
+The rank of the value returned for a quantile q is within about
+eps * n of q * n, where eps is close to 1.7 / k (k being the size of
+the sketch) with high probability: about 1% of the rows for the default
+size.
+"""
+
+import numpy as np
+
+DEFAULT_K = 200  # Size of the sketch (larger is more accurate)
+MIN_CAPACITY = 8  # Smallest capacity of a level
+CAPACITY_RATIO = 2 / 3  # Each level holds this fraction of the next one
+
+
+class QuantileSketch:
+    """
+    A KLL sketch of a set of numbers.
+
+    The values are kept in levels: a value at level h stands for 2**h of
+    the values seen. When a level is full, it is sorted and every other
+    value (starting at random at the first or second one) moves up to the
+    next level.
+    """
+
+    def __init__(self, k=DEFAULT_K, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_values(cls, values, k=DEFAULT_K, seed=None):
+        """Return the sketch of the values (missing values are ignored)."""
+        sketch = cls(k, seed)
+        sketch.update(values)
+        return sketch
+
+    def _capacity(self, level):
+        """Return the number of values a level can hold."""
+        depth = len(self.levels) - level - 1
+        return max(MIN_CAPACITY, int(np.ceil(self.k * CAPACITY_RATIO**depth)))
+
+    def _compress(self):
+        """Compact the levels until none of them is over capacity."""
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # With an odd number of values, the largest one stays here
+            kept = items[len(items) - len(items) % 2:]
+            promoted = items[self._rng.integers(2):len(items) - len(kept):2]
+            self.levels[level] = kept
+            self.levels[level + 1] = np.concatenate(
+                [self.levels[level + 1], promoted]
+                )
+            # A new level shrinks the capacity of the lower ones
+            level = 0
+
+    def update(self, values):
+        """Add values to the sketch."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        """
+        Return the sketch of the values of both sketches.
+
+        Neither sketch is modified, so cached sketches can be merged.
+        The random choices of the merge are seeded from the sizes of both
+        sketches, so merging the same sketches always gives the same
+        result (the median of the app does not change between reruns).
+        """
+        merged = QuantileSketch(max(self.k, other.k), seed=[self.n, other.n])
+        merged.n = self.n + other.n
+        height = max(len(self.levels), len(other.levels))
+        merged.levels = [
+            np.concatenate([
+                self.levels[h] if h < len(self.levels) else np.empty(0),
+                other.levels[h] if h < len(other.levels) else np.empty(0),
+                ])
+            for h in range(height)
+            ]
+        merged._compress()
+        return merged
+
+    def quantile(self, q):
+        """
+        Return an approximation of the q-quantile (0 <= q <= 1) of the
+        values, or NaN if the sketch is empty.
+        """
+        items = np.concatenate(self.levels)
+        if len(items) == 0:
+            return np.nan
+        weights = np.concatenate([
+            np.full(len(level), 2**h) for h, level in enumerate(self.levels)
+            ])
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, q * cumulative[-1])
+        return items[order][min(position, len(items) - 1)]
+
+    def median(self):
+        """Return an approximation of the median of the values."""
+        return self.quantile(0.5)
+
+
+def merge_sketches(sketches):
+    """Return the merge of several sketches (an empty one if none)."""
+    merged = QuantileSketch()
+    for sketch in sketches:
+        merged = merged.merge(sketch)
+    return merged
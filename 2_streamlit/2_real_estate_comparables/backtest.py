@@ -0,0 +1,287 @@
+"""
+Value every property of the test set with the comparables model and
+measure the error against the actual sale price.
+
+The neighbours are searched once, in chunks spread over worker
+processes: for each test property the POOL_SIZE nearest properties of
+the training set are kept. Every (weights, k) pair of a sweep is then
+evaluated by re-ranking that pool, without searching the index again.
+
+Usage:
+------
+    python backtest.py --k 1 5 10 --weights 1,1,1,1 1,1,2,2
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from comparables import (
+    FILE,
+    RELEVANT_COLUMNS,
+    build_index,
+    get_features,
+    prepare_data,
+    standardize,
+)
+
+
+# Constants
+CHUNK_SIZE = 2_000  # Test properties sent to a worker at once
+POOL_SIZE = 50  # Neighbours kept per property, re-ranked for each sweep
+MAX_WORKERS = os.cpu_count()
+
+# Index used by the worker processes (see _init_worker)
+_index = None
+
+
+def _init_worker(index):
+    """Receive the index once per worker process."""
+    global _index
+    _index = index
+
+
+def _query(xn, k):
+    """Return the positions of the k nearest neighbours of each row."""
+    return _index.query(xn, k=k, return_distance=False)
+
+
+def find_neighbours(features, index, test, k=POOL_SIZE,
+                    chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS):
+    """
+    Find the k nearest properties of the training set for every property
+    of the test set.
+
+    Parameters:
+    -----------
+    features: Features
+        The standardised training set, from get_features.
+
+    index: sklearn.neighbors.KDTree
+        The index built on features with build_index.
+
+    test: pd.DataFrame
+        The properties to value.
+
+    k: int
+        The number of neighbours per property.
+
+    chunk_size: int
+        The number of properties sent to a worker at once.
+
+    max_workers: int
+        The number of worker processes.
+
+    Returns:
+    --------
+    positions: np.ndarray
+        One row per property of test, with the positions in train of its
+        neighbours, nearest first.
+    """
+    k = min(k, features.values.shape[0])
+    xn = standardize(features, test).astype(np.float32)
+    chunks = [xn[i:i + chunk_size] for i in range(0, len(xn), chunk_size)]
+    if not chunks:
+        return np.empty((0, k), dtype=np.intp)
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_worker,
+        initargs=(index,)
+    ) as pool:
+        results = list(pool.map(_query, chunks, [k] * len(chunks)))
+    return np.concatenate(results)
+
+
+def rank_neighbours(features, test, positions, weights=None):
+    """
+    Sort the neighbours of each property by weighted distance.
+
+    The distance is the euclidean distance between standardised
+    features, each squared difference being multiplied by its weight.
+    With equal weights the order of find_neighbours is kept.
+
+    Parameters:
+    -----------
+    features: Features
+        The standardised training set, from get_features.
+
+    test: pd.DataFrame
+        The properties to value.
+
+    positions: np.ndarray
+        The neighbours of each property, from find_neighbours.
+
+    weights: array-like
+        One weight per column of RELEVANT_COLUMNS. Defaults to 1 for all.
+
+    Returns:
+    --------
+    positions: np.ndarray
+        The same neighbours, the most similar first.
+    """
+    if weights is None:
+        return positions
+
+    weights = np.asarray(weights, dtype=np.float32)
+    xn = standardize(features, test).astype(np.float32)
+    diff = features.values[positions] - xn[:, np.newaxis, :]
+    distances = (np.square(diff) * weights).sum(axis=2)
+    order = np.argsort(distances, axis=1, kind="stable")
+    return np.take_along_axis(positions, order, axis=1)
+
+
+def estimate_prices(train, positions, k=5):
+    """
+    Estimate the price of each property as the mean price of its k most
+    similar neighbours, as the app does (missing prices are skipped).
+
+    Returns:
+    --------
+    estimates: np.ndarray
+        One estimated price per row of positions (NaN if none of the
+        neighbours has a price).
+    """
+    prices = train.valeur_fonciere.values[positions[:, :k]]
+    known = ~np.isnan(prices)
+    counts = known.sum(axis=1)
+    return np.divide(
+        np.where(known, prices, 0).sum(axis=1),
+        counts,
+        out=np.full(len(prices), np.nan),
+        where=counts > 0
+        )
+
+
+def get_errors(actual, estimates):
+    """
+    Compare the estimated prices to the actual ones.
+
+    Properties without a (positive) actual price or without an estimate
+    are ignored.
+
+    Returns:
+    --------
+    errors: dict
+        The mean absolute error (mae, in euros) and the mean absolute
+        percentage error (mape, in %).
+    """
+    actual = np.asarray(actual, dtype=np.float64)
+    valid = np.isfinite(actual) & (actual > 0) & np.isfinite(estimates)
+    error = np.abs(estimates[valid] - actual[valid])
+    return {
+        'mae': error.mean(),
+        'mape': 100 * (error / actual[valid]).mean(),
+    }
+
+
+def backtest(train, test, features, index, ks=(5,), weights=(None,),
+             max_workers=MAX_WORKERS):
+    """
+    Value every property of the test set for each combination of k and
+    feature weights, and report the errors.
+
+    The neighbours are searched once for the whole sweep, so the weights
+    only re-rank the max(ks, POOL_SIZE) nearest neighbours found with
+    equal weights.
+
+    Parameters:
+    -----------
+    train: pd.DataFrame
+        The training set.
+
+    test: pd.DataFrame
+        The properties to value.
+
+    features: Features
+        The standardised training set, from get_features.
+
+    index: sklearn.neighbors.KDTree
+        The index built on features with build_index.
+
+    ks: list
+        The numbers of comparables to try.
+
+    weights: list
+        The feature weights to try (None means equal weights).
+
+    max_workers: int
+        The number of worker processes used to search the neighbours.
+
+    Returns:
+    --------
+    results: pd.DataFrame
+        One row per (weights, k), with the mae and mape columns.
+    """
+    positions = find_neighbours(
+        features,
+        index,
+        test,
+        k=max(max(ks), POOL_SIZE),
+        max_workers=max_workers
+        )
+
+    results = []
+    for w in weights:
+        ranked = rank_neighbours(features, test, positions, w)
+        for k in ks:
+            estimates = estimate_prices(train, ranked, k)
+            results.append({
+                'weights': "equal" if w is None else
+                           ",".join(f"{x:g}" for x in w),
+                'k': k,
+                **get_errors(test.valeur_fonciere.values, estimates),
+            })
+    return pd.DataFrame(results)
+
+
+def parse_weights(text):
+    """Parse weights given as "1,1,2,2" on the command line."""
+    weights = [float(x) for x in text.split(",")]
+    if len(weights) != len(RELEVANT_COLUMNS):
+        raise argparse.ArgumentTypeError(
+            f"expected {len(RELEVANT_COLUMNS)} weights "
+            f"({', '.join(RELEVANT_COLUMNS)}), got {len(weights)}"
+        )
+    return weights
+
+
+def main():
+    """
+    Run the backtest from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--file", default=FILE,
+                        help="path or URL to the DVF file")
+    parser.add_argument("--k", type=int, nargs="+", default=[5],
+                        help="numbers of comparables to try")
+    parser.add_argument("--weights", type=parse_weights, nargs="+",
+                        default=[None],
+                        help="feature weights to try, e.g. 1,1,2,2 for "
+                             + ", ".join(RELEVANT_COLUMNS))
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="number of worker processes")
+    args = parser.parse_args()
+
+    train, test = prepare_data(args.file)
+    features = get_features(train)
+    index = build_index(features)
+
+    results = backtest(
+        train,
+        test,
+        features,
+        index,
+        ks=args.k,
+        weights=args.weights,
+        max_workers=args.workers
+        )
+    print(f"{len(test)} properties valued")
+    print(results.to_string(index=False, float_format="{:,.2f}".format))
+
+
+if __name__ == "__main__":
+    main()
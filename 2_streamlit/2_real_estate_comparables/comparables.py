@@ -3,13 +3,20 @@ Streamlit app to estimate the price of a property based on the price of
 similar properties.
 """
 
-import geopy.distance as gd
 import numpy as np
 import pandas as pd
 import streamlit as st
+from sklearn.neighbors import KDTree
 import locale
 import json
 import os
+import sys
+from collections import namedtuple
+
+# dvf.py is at the root of the repository (see "Shared code" in the README)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+from dvf import read_dvf  # noqa: E402
 
 
 # Constants
@@ -25,6 +32,21 @@ RELEVANT_COLUMNS = [
     'longitude',
     'latitude'
     ]
+# Columns used by the app (the other ones are not read)
+COLUMNS = [
+    'id_mutation',
+    'date_mutation',
+    'valeur_fonciere',
+    'adresse_numero',
+    'adresse_nom_voie',
+    'nom_commune',
+    'type_local',
+    ] + RELEVANT_COLUMNS
+
+EARTH_RADIUS = 6_371_008.8  # Mean radius, in meters
+
+# Standardised RELEVANT_COLUMNS of the training set (see get_features)
+Features = namedtuple("Features", ["values", "mu", "sd"])
 
 
 def init():
@@ -76,13 +98,16 @@ def prepare_data(file):
         The test set.
     """
 
-    df = pd.read_csv(file, compression="gzip", low_memory=False)
+    # Apartment sales are selected while reading the file (chunk by chunk)
+    df = read_dvf(
+        file,
+        columns=COLUMNS,
+        filters={'type_local': "Appartement", 'nature_mutation': "Vente"}
+        )
 
     # Select the 80% earliest dates as the "database"
     # and the 20% latest to simulate the "new data"
     df = df.sort_values("date_mutation")
-    df = df[df.type_local == "Appartement"]
-    df = df[df.nature_mutation == "Vente"]
     train_size = int(0.8 * len(df))
     train = df[:train_size]
     test = df[train_size:]
@@ -122,7 +147,39 @@ def format_row_info(row):
     st.write(f"{surface} m² | {rooms} room{plural} | {type_local}")
 
 
-def get_similarities(train, row):
+def get_features(train):
+    """
+    Standardise the RELEVANT_COLUMNS of the training set, once.
+
+    Parameters:
+    -----------
+    train: pd.DataFrame
+        The training set.
+
+    Returns:
+    --------
+    features: Features
+        The standardised data (a read-only, contiguous float32 array with
+        one row per row of train) and the mean and standard deviation
+        used to standardise it.
+    """
+    data = train[RELEVANT_COLUMNS].values
+    mu = data.mean(axis=0).astype(np.float32)
+    sd = data.std(axis=0, ddof=1).astype(np.float32)
+
+    values = np.ascontiguousarray((data - mu) / sd, dtype=np.float32)
+    for array in (values, mu, sd):
+        array.flags.writeable = False
+
+    return Features(values, mu, sd)
+
+
+def standardize(features, row):
+    """Standardise the selected property like the training set."""
+    return (row[RELEVANT_COLUMNS].values - features.mu) / features.sd
+
+
+def get_similarities(train, row, features=None):
     """
     Compute the similarity between the selected property and each property in
     the training set.
@@ -135,25 +192,142 @@ def get_similarities(train, row):
     row: pd.DataFrame
         The row of the dataframe corresponding to the selected property.
 
+    features: Features
+        The standardised training set, from get_features. Computed from
+        train if not given.
+
     Returns:
     --------
-    similarities: pd.Series
+    similarities: np.ndarray
         The similarity between the selected property and each property in the
         training set.
     """
+    if features is None:
+        features = get_features(train)
 
-    data = train[RELEVANT_COLUMNS].copy()
+    # Compute the distance to the selected property
+    xn = standardize(features, row).astype(np.float32)
 
-    # Standardize the data
-    mu = data.mean()
-    sd = data.std()
-    data_sd = (data - mu) / sd
+    return np.sqrt(np.square(features.values - xn).sum(axis=1))
 
-    # Compute the distance to the selected property
-    x = row[RELEVANT_COLUMNS].copy().reset_index().drop('index', axis=1)
-    xn = (x - mu) / sd
 
-    return np.sqrt(np.square(data_sd.values - xn.values).sum(axis=1))
+def get_distances(latitude, longitude, lat0, lon0):
+    """
+    Compute the distance in meters between many points and one point,
+    with the haversine formula.
+
+    This works on whole columns at once. It treats the Earth as a sphere,
+    which is within 0.4% of geopy's geodesic distance across France.
+
+    Parameters:
+    -----------
+    latitude, longitude: array-like
+        The coordinates of the points, in degrees.
+
+    lat0, lon0: float
+        The coordinates of the reference point, in degrees.
+
+    Returns:
+    --------
+    distances: np.ndarray
+        The distance in meters from each point to the reference point.
+    """
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon = np.radians(np.asarray(longitude, dtype=np.float64))
+    lat0, lon0 = np.radians(lat0), np.radians(lon0)
+
+    a = np.square(np.sin((lat - lat0) / 2)) + \
+        np.cos(lat) * np.cos(lat0) * np.square(np.sin((lon - lon0) / 2))
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def build_index(features):
+    """
+    Build a nearest-neighbour index over the standardised training set.
+
+    Parameters:
+    -----------
+    features: Features
+        The standardised training set, from get_features.
+
+    Returns:
+    --------
+    index: sklearn.neighbors.KDTree
+        The index, whose positions are the row positions in train.
+    """
+    return KDTree(features.values)
+
+
+def find_comparables(train, features, index, row, k=5, radius=None):
+    """
+    Find the k properties of the training set most similar to the
+    selected one.
+
+    Parameters:
+    -----------
+    train: pd.DataFrame
+        The training set.
+
+    features: Features
+        The standardised training set, from get_features.
+
+    index: sklearn.neighbors.KDTree
+        The index built on features with build_index.
+
+    row: pd.DataFrame
+        The row of the dataframe corresponding to the selected property.
+
+    k: int
+        The number of comparables.
+
+    radius: float
+        If given, only the properties at most this many meters away from
+        the selected one are considered.
+
+    Returns:
+    --------
+    comparables: pd.DataFrame
+        The comparables, most similar first, with a Similarity column
+        between 0 and 1.
+    """
+    if radius is None:
+        distances, positions = index.query(
+            standardize(features, row),
+            k=min(k, len(train))
+            )
+        distances, positions = distances[0], positions[0]
+    else:
+        # Keep the properties within the radius, then rank them
+        meters = get_distances(
+            train.latitude.values,
+            train.longitude.values,
+            row.latitude.values[0],
+            row.longitude.values[0]
+            )
+        positions = np.flatnonzero(meters <= radius)
+        xn = standardize(features, row).astype(np.float32)
+        distances = np.sqrt(
+            np.square(features.values[positions] - xn).sum(axis=1)
+            )
+        order = np.argsort(distances)[:k]
+        distances, positions = distances[order], positions[order]
+
+    comparables = train.iloc[positions].copy()
+    comparables['Similarity'] = np.exp(-distances)
+    return comparables
+
+
+@st.cache_resource
+def load_data(file):
+    """
+    Prepare the data, its standardised features and the nearest-neighbour
+    index once, for all the reruns and sessions.
+
+    The returned objects are shared: do not modify them.
+    """
+    train, test = prepare_data(file)
+    features = get_features(train)
+    return train, test, features, build_index(features)
 
 
 def display_map(comparables, row):
@@ -283,7 +457,7 @@ def main():
 
     # Init and prepare data
     token = init()
-    train, test = prepare_data(FILE)
+    train, test, features, index = load_data(FILE)
 
     # Display title and input box
     st.title("Real estate prices in France")
@@ -293,15 +467,10 @@ def main():
     row = test[test.id_mutation == prop_id].head(1)
     format_row_info(row)
 
-    # Compute similarities in order to find the comparables
-    train['Similarity'] = get_similarities(train, row)
-    train['Similarity'] = np.exp(-train['Similarity'])
+    # Find the most similar properties (the comparables) with the index
+    comparables = find_comparables(train, features, index, row)
 
     # Display the estimated price based on comparables
-    comparables = train.sort_values(
-        'Similarity',
-        ascending=False
-        ).head(5).copy()
     display_price_data(comparables, row)
 
     # Display map of comparables
@@ -311,14 +480,13 @@ def main():
 
     # List the comparables
     row = row.reset_index().drop('index', axis=1)
-    distance = comparables.apply(
-        lambda r: gd.distance(
-            (r.latitude, r.longitude),
-            (row.loc[0, 'latitude'], row.loc[0, 'longitude'])
-            ).km,
-        axis=1
-    )
-    comparables['dist_meters'] = (distance*1000).astype(int)
+    distance = get_distances(
+        comparables.latitude,
+        comparables.longitude,
+        row.loc[0, 'latitude'],
+        row.loc[0, 'longitude']
+        )
+    comparables['dist_meters'] = distance.astype(int)
 
     list_comparables(comparables, token)
 
@@ -0,0 +1,471 @@
+"""
+This module contains helpers to call the APIs used by the GDELT apps.
+
+The sentiment of the article titles is requested concurrently, by a
+pool of MAX_WORKERS threads sharing one keep-alive session, so the total
+time is close to a few round-trips instead of one per title.
+
+search_range searches any time range. One call of the GDELT doc API
+returns at most MAX_RECORDS articles, so a window that returns that many
+is split in two halves, which are searched again (concurrently). A quiet
+range thus takes a single call. GDELT throttles rapid requests, so
+at most MAX_SEARCHES calls run at the same time (for all the users), and
+a window that fails is tried again once before being skipped.
+
+The sentiment API can also be sent the titles in batches (a POST of a
+list, see get_sentiments). If it does not support it, the titles are
+sent one by one. iter_sentiments gives the sentiments as they arrive,
+so that the app can display them without waiting for the slowest one.
+
+The answers of both APIs are kept in memory for CACHE_TTL seconds and
+shared by all the users of the app. If several users ask for the same
+thing at the same time, only one request is sent and they all wait for
+it.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+    )
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GDELT_API = "https://api.gdeltproject.org/api/v2/doc/doc"
+START = "20190920133005"  # Time window of the search (YYYYMMDDHHMMSS)
+END = "20190920143005"
+DATETIME_FORMAT = "%Y%m%d%H%M%S"
+MAX_RECORDS = 250  # Articles per call (the maximum of the doc API)
+MIN_WINDOW = timedelta(minutes=15)  # Windows are not split below this
+MAX_WINDOWS = 64  # Most windows searched by search_range
+MAX_SEARCHES = 4  # GDELT calls running at the same time
+RETRY_DELAY = 5  # Seconds before a failed window is searched again
+
+MAX_WORKERS = 8  # Sentiment requests sent at the same time
+BATCH_SIZE = 25  # Titles sent at once by the batch mode
+TIMEOUT = 10  # In seconds
+UNKNOWN = "UNKNOWN"  # Sentiment when the API does not answer
+
+CACHE_TTL = 15 * 60  # In seconds
+CACHE_SIZE = 10_000  # Answers kept per API
+
+_session = None
+_session_lock = threading.Lock()
+
+# Taken by each GDELT call, to send at most MAX_SEARCHES at once
+_search_slots = threading.BoundedSemaphore(MAX_SEARCHES)
+
+# Sentiment APIs that answered that they do not support batches
+_no_batching = set()
+
+
+def get_session():
+    """
+    Return the session shared by all the requests of the process.
+
+    The session keeps the connections open between requests, with one
+    connection per worker for each host.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=MAX_WORKERS,
+                pool_maxsize=MAX_WORKERS
+                )
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers["User-Agent"] = "request"
+    return _session
+
+
+class TTLCache:
+    """
+    A thread-safe cache whose entries expire after ttl seconds, and which
+    keeps at most max_size of them (the least recently used are dropped).
+
+    Concurrent requests for a missing key share a single load.
+    Failed loads are not cached.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_size=CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # Key -> (expiry time, value), least recently used first
+        self._items = OrderedDict()
+        # Loads in progress
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        Return the value of key, calling load() to compute it if it is
+        missing or expired.
+
+        The returned value is shared: do not modify it.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._items.move_to_end(key)
+                    return item[1]
+                del self._items[key]
+            future = self._in_flight.get(key)
+            loading = future is None
+            if loading:
+                future = self._in_flight[key] = Future()
+
+        if not loading:
+            return future.result()
+
+        try:
+            value = load()
+        except Exception as err:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(err)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def _store(self, key, value):
+        """Add an entry (the lock must be held)."""
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def lookup(self, key, default=None):
+        """Return the value of key if it is cached, default otherwise."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] <= time.monotonic():
+                return default
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key, value):
+        """Cache a value computed elsewhere."""
+        with self._lock:
+            self._store(key, value)
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            self._items.clear()
+
+
+_articles_cache = TTLCache()
+_sentiment_cache = TTLCache()
+
+
+def search_articles(query, lang="eng", start=START, end=END,
+                    api=GDELT_API):
+    """
+    Search news articles with the GDELT doc API.
+
+    Parameters:
+    -----------
+    query: str
+        The exact phrase to look for.
+    lang: str
+        The language of the sources ("eng", "spa", ...).
+    start, end: str
+        The time window of the search, as YYYYMMDDHHMMSS.
+    api: str
+        The URL of the doc API.
+
+    Returns:
+    --------
+    articles: list
+        The articles found (dicts with "title", "url", ...). The list is
+        shared with the other users: do not modify it.
+    """
+    params = {
+        "query": f'"{query}" sourcelang:{lang}',
+        "startdatetime": start,
+        "enddatetime": end,
+        "maxrecords": MAX_RECORDS,
+        "format": "json",
+    }
+
+    def load():
+        with _search_slots:
+            response = get_session().get(api, params=params, timeout=TIMEOUT)
+        response.raise_for_status()
+        return response.json().get("articles", [])
+
+    return _articles_cache.get((api, query, lang, start, end), load)
+
+
+def split_window(start, end):
+    """
+    Return the two halves of the window from start to end (strings as
+    YYYYMMDDHHMMSS), as (start, end) strings.
+    """
+    a = datetime.strptime(start, DATETIME_FORMAT)
+    b = datetime.strptime(end, DATETIME_FORMAT)
+    middle = (a + (b - a) / 2).strftime(DATETIME_FORMAT)
+    return [(start, middle), (middle, end)]
+
+
+def search_range(query, start, end, lang="eng", api=GDELT_API,
+                 max_workers=MAX_SEARCHES, retry_delay=RETRY_DELAY,
+                 min_window=MIN_WINDOW, max_windows=MAX_WINDOWS):
+    """
+    Search news articles over any time range.
+
+    The whole range is searched first. Each window that returns
+    MAX_RECORDS articles may have more, so it is split in two halves
+    which are searched instead, until the windows return fewer articles,
+    are shorter than 2 * min_window, or there are max_windows of them
+    (the articles of such windows may be incomplete). The windows of
+    each round are searched concurrently with search_articles. A window
+    whose search fails (e.g. GDELT answers 429 Too Many Requests) is
+    searched again once after retry_delay seconds, and then skipped.
+
+    Parameters:
+    -----------
+    query: str
+        The exact phrase to look for.
+    start, end: datetime
+        The time range of the search.
+    lang: str
+        The language of the sources ("eng", "spa", ...).
+    api: str
+        The URL of the doc API.
+    max_workers: int
+        The number of windows searched at the same time.
+    retry_delay: float
+        The number of seconds before a failed window is searched again.
+    min_window: timedelta
+        The windows shorter than twice this are not split.
+    max_windows: int
+        The maximum number of windows the range is split into.
+
+    Returns:
+    --------
+    articles: list
+        The articles of all the windows, in chronological order of the
+        windows, each URL appearing once.
+    failed: list
+        The (start, end) windows that could not be searched, as
+        YYYYMMDDHHMMSS strings, whose articles are missing.
+    """
+    def search(w):
+        for attempt in range(2):
+            if attempt:
+                time.sleep(retry_delay)
+            try:
+                return search_articles(query, lang, w[0], w[1], api)
+            except (requests.RequestException, ValueError):
+                pass
+        return None
+
+    def is_full(w):
+        length = (datetime.strptime(w[1], DATETIME_FORMAT)
+                  - datetime.strptime(w[0], DATETIME_FORMAT))
+        return (results[w] is not None
+                and len(results[w]) >= MAX_RECORDS
+                and length >= 2 * min_window)
+
+    # Windows in chronological order, and their articles once searched
+    windows = [
+        (start.strftime(DATETIME_FORMAT), end.strftime(DATETIME_FORMAT))
+        ]
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            pending = [w for w in windows if w not in results]
+            results.update(zip(pending, pool.map(search, pending)))
+            full = [w for w in pending if is_full(w)]
+            if not full or len(windows) + len(full) > max_windows:
+                break
+            windows = [
+                half for w in windows
+                for half in (split_window(*w) if w in full else [w])
+                ]
+
+    articles = {}
+    failed = []
+    for w in windows:
+        if results[w] is None:
+            failed.append(w)
+            continue
+        for article in results[w]:
+            articles.setdefault(article["url"], article)
+    return list(articles.values()), failed
+
+
+def get_sentiment(api, text, lang="en"):
+    """
+    Return the sentiment of a text ("POSITIVE", "NEGATIVE", ...), or
+    UNKNOWN if the API does not answer.
+    """
+    def load():
+        response = get_session().get(
+            api,
+            params={"text": text, "lang": lang},
+            timeout=TIMEOUT
+            )
+        response.raise_for_status()
+        return response.json()["Sentiment"]
+
+    try:
+        return _sentiment_cache.get((api, text, lang), load)
+    except (requests.RequestException, ValueError, KeyError):
+        return UNKNOWN
+
+
+def _get_batch(api, texts, lang):
+    """
+    Return the sentiments of several texts with one POST request, or None
+    if the API did not answer them.
+
+    The request body is {"texts": [...], "lang": ...} and the answer
+    {"Sentiments": [...]}, in the order of texts.
+    """
+    try:
+        response = get_session().post(
+            api,
+            json={"texts": texts, "lang": lang},
+            timeout=TIMEOUT
+            )
+    except requests.RequestException:
+        return None
+    if response.status_code in (400, 404, 405, 501):
+        # The endpoint only knows single texts
+        _no_batching.add(api)
+        return None
+    if response.status_code != 200:
+        return None
+    try:
+        sentiments = response.json()["Sentiments"]
+    except (ValueError, KeyError, TypeError):
+        _no_batching.add(api)
+        return None
+    if not isinstance(sentiments, list) or len(sentiments) != len(texts):
+        return None
+    return sentiments
+
+
+def get_sentiments(api, texts, lang="en", max_workers=MAX_WORKERS,
+                   batch_size=None):
+    """
+    Return the sentiment of each text, in the order of texts.
+
+    Parameters:
+    -----------
+    api: str
+        The URL of the sentiment API.
+    texts: list
+        The texts to analyse.
+    lang: str
+        The language of the texts.
+    max_workers: int
+        The number of requests sent at the same time.
+    batch_size: int
+        If given, the texts are sent by batches of this size (see
+        _get_batch). The texts of a batch the API does not answer are
+        sent one by one.
+
+    Returns:
+    --------
+    sentiments: list
+        One sentiment per text (see get_sentiment).
+    """
+    if not texts:
+        return []
+
+    if batch_size is None or api in _no_batching:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(
+                lambda text: get_sentiment(api, text, lang), texts
+                ))
+
+    # Only the texts that are not cached are sent, once each
+    missing = [
+        text for text in dict.fromkeys(texts)
+        if _sentiment_cache.lookup((api, text, lang)) is None
+        ]
+    batches = [
+        missing[i:i + batch_size] for i in range(0, len(missing), batch_size)
+        ]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        answers = list(pool.map(
+            lambda batch: _get_batch(api, batch, lang), batches
+            ))
+
+    fallback = []
+    for batch, sentiments in zip(batches, answers):
+        if sentiments is None:
+            fallback.extend(batch)
+            continue
+        for text, sentiment in zip(batch, sentiments):
+            _sentiment_cache.put((api, text, lang), sentiment)
+    if fallback:
+        get_sentiments(api, fallback, lang, max_workers)
+
+    return [
+        _sentiment_cache.lookup((api, text, lang), UNKNOWN) for text in texts
+        ]
+
+
+def iter_sentiments(api, texts, lang="en", max_workers=MAX_WORKERS,
+                    batch_size=None):
+    """
+    Yield (position, sentiment) for each text, as soon as its sentiment
+    is known (so not in the order of texts).
+
+    The texts are sent one by one (see get_sentiment) or by batches (see
+    _get_batch), by a single pool of max_workers threads. The texts of a
+    batch the API does not answer are then sent one by one.
+
+    The parameters are those of get_sentiments.
+    """
+    size = 1 if batch_size is None or api in _no_batching else batch_size
+    chunks = [
+        list(range(i, min(i + size, len(texts))))
+        for i in range(0, len(texts), size)
+        ]
+
+    def score(chunk):
+        """Return the sentiments of a chunk, or None if it failed."""
+        if len(chunk) == 1:
+            return [get_sentiment(api, texts[chunk[0]], lang)]
+        missing = [
+            text for text in dict.fromkeys(texts[i] for i in chunk)
+            if _sentiment_cache.lookup((api, text, lang)) is None
+            ]
+        if missing:
+            sentiments = _get_batch(api, missing, lang)
+            if sentiments is None:
+                return None
+            for text, sentiment in zip(missing, sentiments):
+                _sentiment_cache.put((api, text, lang), sentiment)
+        return [
+            _sentiment_cache.lookup((api, texts[i], lang), UNKNOWN)
+            for i in chunk
+            ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(score, chunk): chunk for chunk in chunks}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = futures.pop(future)
+                sentiments = future.result()
+                if sentiments is not None:
+                    yield from zip(chunk, sentiments)
+                    continue
+                for i in chunk:
+                    futures[pool.submit(score, [i])] = [i]
@@ -1,5 +1,8 @@
+from datetime import date, datetime, time
+
 import streamlit as st
-import requests
+
+from gdelt_api import search_range
 
 
 st.title("News Search with GDELT")
@@ -8,14 +11,34 @@ query = st.text_input("Enter your search query")
 
 lang = st.selectbox("Select language", ["eng", "spa"])
 
-API_NEWS = f'https://api.gdeltproject.org/api/v2/doc/doc?query=%22{query}%22%20sourcelang:{lang}&startdatetime=20190920133005&enddatetime=20190920143005&format=json'
+# Any range can be searched: the busy ones are split into windows
+# searched in parallel
+dates = st.date_input(
+    "Select dates",
+    value=(date(2019, 9, 20), date(2019, 9, 20))
+)
+start_time = st.time_input("From", value=time(13, 30))
+end_time = st.time_input("To", value=time(14, 30))
 
 if st.button("Search"):
-    data = requests.get(API_NEWS, headers={'User-Agent': 'request'})
-
-    results = data.json()
-    if 'articles' in results:
-        for result in results['articles']:
+    if len(dates) != 2:
+        st.warning("Select the first and last days of the search.")
+        st.stop()
+    start = datetime.combine(dates[0], start_time)
+    end = datetime.combine(dates[1], end_time)
+    if end <= start:
+        st.warning("The end of the search must be after its start.")
+        st.stop()
+
+    # Identical searches are answered from the cache
+    articles, failed = search_range(query, start, end, lang)
+    if failed:
+        st.warning(
+            f"GDELT did not answer for {len(failed)} of the time windows, "
+            "so their articles are missing. Try again later."
+            )
+    if articles:
+        for result in articles:
 
             st.subheader(result['title'])
 
@@ -1,5 +1,10 @@
+from datetime import date, datetime, time
+from time import perf_counter
+
 import streamlit as st
-import requests
+
+from gdelt_api import search_range
+from sentiment import LOCAL_NAME, MODEL_FILE, LocalSentiment, RemoteSentiment
 
 EXTERNAL_SENTIMENT_API = # INSERT API ENDPOINT HERE (Check Moodle)
 
@@ -10,32 +15,89 @@ query = st.text_input("Enter your search query")
 
 lang = st.selectbox("Select language", ["eng", "spa"])
 
-API_NEWS = f'https://api.gdeltproject.org/api/v2/doc/doc?query=%22{query}%22%20sourcelang:{lang}&startdatetime=20190920133005&enddatetime=20190920143005&format=json'
+# Any range can be searched: the busy ones are split into windows
+# searched in parallel
+dates = st.date_input(
+    "Select dates",
+    value=(date(2019, 9, 20), date(2019, 9, 20))
+)
+start_time = st.time_input("From", value=time(13, 30))
+end_time = st.time_input("To", value=time(14, 30))
+
+# The remote API is the reference, the local model needs no network
+method = st.radio(
+    "Sentiment analysis",
+    ["Remote API", LOCAL_NAME],
+    horizontal=True
+)
+if method == "Remote API":
+    backend = RemoteSentiment(EXTERNAL_SENTIMENT_API)
+else:
+    backend = LocalSentiment()
+    if not MODEL_FILE:
+        st.caption(
+            "The keyword heuristic only knows a short list of words "
+            "(e.g. \"crisis\", \"record\"): the other titles are NEUTRAL. "
+            "Set SENTIMENT_MODEL to a trained model for real results."
+        )
 
 if st.button("Search"):
-    data = requests.get(API_NEWS, headers={'User-Agent': 'request'})
+    if len(dates) != 2:
+        st.warning("Select the first and last days of the search.")
+        st.stop()
+    start = datetime.combine(dates[0], start_time)
+    end = datetime.combine(dates[1], end_time)
+    if end <= start:
+        st.warning("The end of the search must be after its start.")
+        st.stop()
+
+    clicked = perf_counter()
+
+    # Identical searches are answered from the cache
+    articles, failed = search_range(query, start, end, lang)
+    if failed:
+        st.warning(
+            f"GDELT did not answer for {len(failed)} of the time windows, "
+            "so their articles are missing. Try again later."
+            )
+    if articles:
+        timing = st.empty()
 
-    results = data.json()
-    if 'articles' in results:
-        for result in results['articles']:
+        # The titles are displayed at once, with a placeholder for their
+        # sentiment, which is filled in as soon as it arrives
+        badges = []
+        for result in articles:
 
             st.subheader(result['title'])
 
-            with st.spinner("Analyzing sentiment..."):
-                sentiment_query = f"{EXTERNAL_SENTIMENT_API}?text={result['title']}&lang=en"
-                sentiment_response = requests.get(sentiment_query)
-
-            if sentiment_response.status_code == 200:
-                sentiment_data = sentiment_response.json()
-                sentiment = sentiment_data['Sentiment']
-                if sentiment == "POSITIVE":
-                    st.badge(f"{sentiment}", color="blue", icon="✔️")
-                elif sentiment == "NEGATIVE":
-                    st.badge(f"{sentiment}", color="red", icon="❌")
-                else:
-                    st.badge(f"{sentiment}", color="gray")
-            else:
-                sentiment = "UNKNOWN"
+            badge = st.empty()
+            badge.caption("Analyzing sentiment...")
+            badges.append(badge)
 
             st.link_button("Read more", url=result['url'])
             st.write("---")
+
+        listed = perf_counter() - clicked
+        first = None
+
+        # All the titles are given to the backend at once: the local
+        # model scores them in one call, the remote API concurrently
+        for i, sentiment in backend.iter_sentiments(
+            [result['title'] for result in articles]
+        ):
+            if first is None:
+                first = perf_counter() - clicked
+            if sentiment == "POSITIVE":
+                badges[i].badge(f"{sentiment}", color="blue", icon="✔️")
+            elif sentiment == "NEGATIVE":
+                badges[i].badge(f"{sentiment}", color="red", icon="❌")
+            elif sentiment != "UNKNOWN":
+                badges[i].badge(f"{sentiment}", color="gray")
+            else:
+                badges[i].empty()
+
+        timing.caption(
+            f"Articles: {listed:.2f} s | "
+            f"first sentiment: {first:.2f} s | "
+            f"all sentiments: {perf_counter() - clicked:.2f} s"
+        )
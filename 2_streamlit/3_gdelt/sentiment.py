@@ -0,0 +1,161 @@
+"""
+This module contains the sentiment backends of the GDELT app.
+
+Both backends have the same interface (get_sentiments and
+iter_sentiments) and return "POSITIVE", "NEGATIVE" or "NEUTRAL" for
+each text:
+- RemoteSentiment calls the sentiment API (see gdelt_api). It is the
+  reference.
+- LocalSentiment scores all the texts at once with a scikit-learn model,
+  without any network access.
+
+The local model is loaded once per process, from the file given by the
+SENTIMENT_MODEL environment variable (a pipeline fitted on labelled
+headlines and saved with joblib, with a predict_proba method and the
+classes "NEGATIVE" and "POSITIVE"). Such a file is written by this
+module from a CSV file of headlines, with the columns title and label
+("POSITIVE" or "NEGATIVE"). tests/data/headlines.csv is a small example,
+real results need thousands of headlines.
+
+Without that file, the local model is only a keyword heuristic: it is
+fitted on the word lists below, so it only knows those exact words and
+the titles without any of them are NEUTRAL (e.g. "Hurricane kills 12"
+is, as "kills" is not listed). It is a fallback to work offline, not a
+replacement of the API.
+
+Usage:
+------
+    python sentiment.py headlines.csv model.joblib
+    SENTIMENT_MODEL=model.joblib streamlit run gdelt_step_3.py
+"""
+
+import argparse
+import os
+import threading
+
+import joblib
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+
+from gdelt_api import BATCH_SIZE, get_sentiments, iter_sentiments
+
+MODEL_FILE = os.environ.get("SENTIMENT_MODEL")
+# What the local model is, for the apps
+LOCAL_NAME = "Local model" if MODEL_FILE else "Keyword heuristic (offline)"
+NEUTRAL_MARGIN = 0.15  # Probabilities closer than this to 0.5 are NEUTRAL
+
+POSITIVE_WORDS = [
+    "agree", "award", "beat", "best", "boost", "breakthrough", "celebrate",
+    "gain", "good", "great", "grow", "growth", "happy", "hope", "improve",
+    "innovative", "launch", "lead", "love", "peace", "praise", "profit",
+    "rally", "record", "recover", "recovery", "rise", "rescue", "safe",
+    "soar", "strong", "succeed", "success", "support", "surge", "top",
+    "upgrade", "win", "winner", "wins",
+    ]
+NEGATIVE_WORDS = [
+    "accident", "attack", "bad", "ban", "collapse", "crash", "crisis",
+    "cut", "danger", "dead", "death", "decline", "disaster", "drop",
+    "fail", "failure", "fall", "fear", "fraud", "hack", "kill",
+    "lawsuit", "layoffs", "lose", "loss", "plunge", "poor", "protest",
+    "recession", "risk", "scandal", "slump", "strike", "threat", "virus",
+    "violence", "war", "warn", "weak", "worst",
+    ]
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def train_model(texts, labels):
+    """Return a bag-of-words logistic regression fitted on the texts."""
+    model = make_pipeline(
+        CountVectorizer(lowercase=True, binary=True),
+        LogisticRegression(C=10)
+        )
+    return model.fit(texts, labels)
+
+
+def get_model():
+    """
+    Return the local model, loaded on first use, or the keyword heuristic
+    if there is no model file.
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            if MODEL_FILE:
+                _model = joblib.load(MODEL_FILE)
+            else:
+                _model = train_model(
+                    POSITIVE_WORDS + NEGATIVE_WORDS,
+                    ["POSITIVE"] * len(POSITIVE_WORDS)
+                    + ["NEGATIVE"] * len(NEGATIVE_WORDS)
+                    )
+    return _model
+
+
+class LocalSentiment:
+    """
+    Sentiment of texts computed in the process, in one batch, by the
+    local model (see get_model).
+    """
+
+    def __init__(self, neutral_margin=NEUTRAL_MARGIN):
+        self.neutral_margin = neutral_margin
+
+    def get_sentiments(self, texts):
+        """Return the sentiment of each text, in the order of texts."""
+        if not texts:
+            return []
+        model = get_model()
+        positive = list(model.classes_).index("POSITIVE")
+        probabilities = model.predict_proba(list(texts))[:, positive]
+        return [
+            "NEUTRAL" if abs(p - 0.5) < self.neutral_margin
+            else "POSITIVE" if p > 0.5 else "NEGATIVE"
+            for p in probabilities
+            ]
+
+    def iter_sentiments(self, texts):
+        """Yield (position, sentiment) for each text."""
+        yield from enumerate(self.get_sentiments(texts))
+
+
+class RemoteSentiment:
+    """Sentiment of texts requested to the sentiment API."""
+
+    def __init__(self, api, lang="en", batch_size=BATCH_SIZE):
+        self.api = api
+        self.lang = lang
+        self.batch_size = batch_size
+
+    def get_sentiments(self, texts):
+        """Return the sentiment of each text, in the order of texts."""
+        return get_sentiments(
+            self.api, texts, self.lang, batch_size=self.batch_size
+            )
+
+    def iter_sentiments(self, texts):
+        """Yield (position, sentiment) for each text, as they arrive."""
+        return iter_sentiments(
+            self.api, texts, self.lang, batch_size=self.batch_size
+            )
+
+
+def main():
+    """
+    Train a local model on labelled headlines from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "headlines", help="CSV file with the columns title and label"
+        )
+    parser.add_argument("path", help="where to write the model (.joblib)")
+    args = parser.parse_args()
+    headlines = pd.read_csv(args.headlines)
+    joblib.dump(train_model(headlines["title"], headlines["label"]), args.path)
+
+
+if __name__ == "__main__":
+    main()
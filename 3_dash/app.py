@@ -6,9 +6,9 @@ First example to illustrate how to create a Dash app.
 The use case is to display real estate prices in Paris.
 """
 
-from dash import Dash, html, dash_table, dcc
+from dash import Dash, html, dcc, Input, Output, callback
 
-from common import prepare_data
+from common import prepare_data, get_table, query_table
 
 # Like in Streamlit, you can code any python logic here
 # For example, we can load the data from the French government's
@@ -35,15 +35,27 @@ app.layout = html.Div([
             )
     ]),
     html.H2("Raw data"),
-    dash_table.DataTable(
-        id='table',
-        columns=[{"name": i, "id": i} for i in df.columns],
-        data=df.to_dict('records'),
-    )
+    # The table only holds one page of rows at a time,
+    # the callback below sends the requested page
+    get_table('table', df.columns)
 ],
 className="app-shell")
 
 
+# Paging, sorting and filtering are done here, on the server
+@callback(
+    Output('table', 'data'),
+    Output('table', 'page_count'),
+    Input('table', 'page_current'),
+    Input('table', 'page_size'),
+    Input('table', 'sort_by'),
+    Input('table', 'filter_query')
+)
+def update_table(page_current, page_size, sort_by, filter_query):
+    """Send the requested page of the table."""
+    return query_table(df, page_current, page_size, sort_by, filter_query)
+
+
 # The main function should call the run method
 def main():
     """Run the Dash app."""
@@ -8,9 +8,9 @@ In this example, we'll add a Dropdown to select the year,
 and the callback function to update the table.
 """
 
-from dash import Dash, html, dash_table, dcc, Input, Output, callback
+from dash import Dash, html, dcc, Input, Output, callback
 
-from common import prepare_data
+from common import get_data, get_table, query_table
 
 
 # Function to load data from French government's Open Data Portal
@@ -38,10 +38,10 @@ app.layout = html.Div([
         options=['2020', '2021', '2022', '2023'],
         value='2022'
     ),
-    # Now this is a placeholder for the table,
-    # not the table itself
-    # It will be populated by the callback function
-    html.Div(id='table-container')
+    # Now this is an empty table, not the data itself
+    # It will be populated, one page at a time,
+    # by the callback function
+    html.Div(get_table('table'), id='table-container')
 
 ],
 className="app-shell")
@@ -54,29 +54,34 @@ className="app-shell")
 # as arguments and returns a function that will be called
 # when the input changes
 #
-# Output('table-container', 'children') specifies the value
+# Output('table', 'data') specifies the value
 # and component that will be updated
-# (the 'children' of the 'table-container' div).
+# (the 'data' of the 'table', i.e. the rows of the current page).
 #
 # Input('year-dd', 'value') specifies which value of which
 # component will trigger the function.
 # (the 'value' of the 'year-dd' dropdown).
+# The page, sort and filter of the table are inputs too:
+# they are applied on the server, so that only one page
+# of rows is sent to the browser.
 #
 # The return value of the function specifies what will be the
 # new value of the output.
 @callback(
-    Output('table-container', 'children'),
-    Input('year-dd', 'value')
+    Output('table', 'data'),
+    Output('table', 'page_count'),
+    Input('year-dd', 'value'),
+    Input('table', 'page_current'),
+    Input('table', 'page_size'),
+    Input('table', 'sort_by'),
+    Input('table', 'filter_query')
 )
-def update_output(value):
+def update_output(value, page_current, page_size, sort_by, filter_query):
     """Update the table with the data for the selected year."""
     fname = get_file(value)
-    df = prepare_data(fname)
-    return dash_table.DataTable(
-        id='table',
-        columns=[{"name": i, "id": i} for i in df.columns],
-        data=df.to_dict('records'),
-    )
+    df = get_data(fname)
+    # Only the requested page is sent to the browser
+    return query_table(df, page_current, page_size, sort_by, filter_query)
 
 
 # The main function should call the run method
@@ -9,9 +9,9 @@ In this example, on top of the Dropdown to select the year,
 we add a map.
 """
 
-from dash import Dash, html, dash_table, dcc, Input, Output, callback
+from dash import Dash, html, dcc, Input, Output, callback
 
-from common import prepare_data, get_map
+from common import get_data, get_map, get_viewport, get_table, query_table
 
 
 # Function to load data from French government's Open Data Portal
@@ -36,7 +36,7 @@ app.layout = html.Div([
         options=['2020', '2021', '2022', '2023'],
         value='2022'
     ),
-    html.Div(id='table-container'),
+    html.Div(get_table('table'), id='table-container'),
     # Now we add the map
     dcc.Graph(id='map')
 ],
@@ -51,70 +51,53 @@ className="app-shell"
 # as arguments and returns a function that will be called
 # when the input changes
 #
-# Output('table-container', 'children') specifies the value
+# Output('table', 'data') specifies the value
 # and component that will be updated
-# (the 'children' of the 'table-container' div).
+# (the 'data' of the 'table', i.e. the rows of the current page).
 #
 # Input('year-dd', 'value') specifies which value of which
 # component will trigger the function.
 # (the 'value' of the 'year-dd' dropdown).
+# The page, sort and filter of the table are inputs too:
+# they are applied on the server, so that only one page
+# of rows is sent to the browser.
 #
 # The return value of the function specifies what will be the
 # new value of the output.
 @callback(
-    Output('table-container', 'children'),
-    Input('year-dd', 'value')
+    Output('table', 'data'),
+    Output('table', 'page_count'),
+    Input('year-dd', 'value'),
+    Input('table', 'page_current'),
+    Input('table', 'page_size'),
+    Input('table', 'sort_by'),
+    Input('table', 'filter_query')
 )
-def update_output(value):
+def update_output(value, page_current, page_size, sort_by, filter_query):
     """Update the table with the data for the selected year."""
     fname = get_file(value)
-    df = prepare_data(fname)
-    return dash_table.DataTable(
-        id='table',
-        columns=[{"name": i, "id": i} for i in df.columns],
-        data=df.to_dict('records'),
-    )
+    df = get_data(fname)
+    # Only the requested page is sent to the browser
+    return query_table(df, page_current, page_size, sort_by, filter_query)
 
 
 # Exercise: Add a callback to update the map
 # when the year is changed
 # Hint: You can use the get_map function
+# The map is also redrawn when the user pans or zooms (relayoutData),
+# to show clusters or individual sales depending on the viewport
 @callback(
     Output('map', 'figure'),
-    Input('year-dd', 'value')
+    Input('year-dd', 'value'),
+    Input('map', 'relayoutData')
 )
-def update_map(value):
+def update_map(value, relayout_data):
     """Update the map with the data for the selected year."""
     fname = get_file(value)
-    df = prepare_data(fname)
-    map_fig = get_map(df)
+    df = get_data(fname)
+    map_fig = get_map(df, get_viewport(relayout_data))
     return map_fig
 
-def get_map(df):
-    """Return a plotly map with the data."""
-
-    # Generate texts for the markers
-    # Add to the text:
-    # - the surface of the building
-    # - the number of rooms
-    # - the type of building
-    # - the price
-    # - the address
-    text = [
-        f"Surface: {surface} m²\n"
-        f"Rooms: {rooms}\n"
-        f"Type: {type_local}\n"
-        f"Price: {price} €\n"
-        f"Address: {int(number):d} {address}"
-        for surface, rooms, type_local, price, address, number in zip(
-            df["surface_reelle_bati"],
-            df["nombre_pieces_principales"],
-            df["type_local"],
-            df["valeur_fonciere"],
-            df["adresse_nom_voie"],
-            df["adresse_numero"]
-        )
-    ]
 
 # The main function should call the run method
 def main():
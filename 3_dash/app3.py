@@ -10,17 +10,25 @@ e.g. to click on a certain property, and how to retrieve
 information about the selected property.
 """
 
-from dash import Dash, html, dash_table, dcc, Input, Output, callback
+from dash import Dash, html, dcc, Input, Output, State, callback
 import dash_bootstrap_components as dbc
 
-from common import prepare_data, get_map
+from common import (
+    format_property,
+    get_data,
+    get_map,
+    get_property,
+    get_table,
+    get_url,
+    get_viewport,
+    query_table,
+)
 
 
 # Function to load data from French government's Open Data Portal
 def get_file(year):
     """Return the URL to the CSV file for the given year."""
-    return (f"https://files.data.gouv.fr/geo-dvf/latest/csv/{year}/"
-            "departements/75.csv.gz")
+    return get_url(year, 75)
 
 
 # Create the Dash app
@@ -42,7 +50,7 @@ app.layout = html.Div([
         options=['2020', '2021', '2022', '2023'],
         value='2022'
     ),
-    html.Div(id='table-container'),
+    html.Div(get_table('table'), id='table-container'),
     # In this example, we add a placeholder for the info
     # about the selected property
     # We also illustrate how to use the dbc.Row and dbc.Col
@@ -62,52 +70,63 @@ className="app-shell")
 
 # Callback for updating the table
 @callback(
-    Output('table-container', 'children'),
-    Input('year-dd', 'value')
+    Output('table', 'data'),
+    Output('table', 'page_count'),
+    Input('year-dd', 'value'),
+    Input('table', 'page_current'),
+    Input('table', 'page_size'),
+    Input('table', 'sort_by'),
+    Input('table', 'filter_query')
 )
-def update_output(value):
+def update_output(value, page_current, page_size, sort_by, filter_query):
     """Update the table with the data for the selected year."""
     fname = get_file(value)
-    df = prepare_data(fname)
-    return dash_table.DataTable(
-        id='table',
-        columns=[{"name": i, "id": i} for i in df.columns],
-        data=df.to_dict('records'),
-    )
+    df = get_data(fname)
+    # Only the requested page is sent to the browser
+    return query_table(df, page_current, page_size, sort_by, filter_query)
 
 
 # Callback for updating the map
+# (also when the user pans or zooms, to update the clusters)
 @callback(
     Output('map', 'figure'),
-    Input('year-dd', 'value')
+    Input('year-dd', 'value'),
+    Input('map', 'relayoutData')
 )
-def update_map(value):
+def update_map(value, relayout_data):
     """Update the map with the data for the selected year."""
     fname = get_file(value)
-    df = prepare_data(fname)
-    return get_map(df)
+    df = get_data(fname)
+    return get_map(df, get_viewport(relayout_data))
 
 
-def format_property_data(click_data):
-    """Format the click data for display."""
+def format_property_data(click_data, file):
+    """Format the data of the clicked property for display."""
     if click_data is None:
         return "Click on the map to display information"
 
-    customdata = click_data['points'][0]['customdata']
-    elements = customdata.split("\n")
+    point = click_data['points'][0]
+    if 'customdata' not in point:
+        return "Zoom in to select a property"
+
+    # The map only carries the row key, the details come from the server
+    row = get_property(file, point['customdata'])
+    if row is None:
+        return "Click on the map to display information"
 
     # Return as a list of HTML components
-    return [html.P(f"{elem}") for elem in elements]
+    return [html.P(f"{elem}") for elem in format_property(row)]
 
 
 # Callback for updating the info
 @callback(
     Output('info', 'children'),
-    Input('map', 'clickData')
+    Input('map', 'clickData'),
+    State('year-dd', 'value')
 )
-def display_click_data(click_data):
+def display_click_data(click_data, value):
     """Update the information with the selected property."""
-    return format_property_data(click_data)
+    return format_property_data(click_data, get_file(value))
 
 
 # The main function should call the run method
@@ -2,8 +2,70 @@
 This module contains common functions used in the dashboards.
 """
 
+import math
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
 import plotly.graph_objects as go
 import pandas as pd
+from dash import dash_table
+
+# dvf.py is at the root of the repository (see "Shared code" in the README)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from dvf import read_dvf  # noqa: E402
+# For the apps, which get the functions of dvf.py through this module
+from dvf import get_url  # noqa: E402, F401
+
+# Columns displayed by the dashboards (the other ones are not read)
+COLUMNS = [
+    'id_mutation',
+    'date_mutation',
+    'valeur_fonciere',
+    'adresse_numero',
+    'adresse_suffixe',
+    'adresse_nom_voie',
+    'code_postal',
+    'type_local',
+    'surface_reelle_bati',
+    'nombre_pieces_principales',
+    'longitude',
+    'latitude',
+    ]
+
+# Above this number of points in view, the map shows clusters (see get_map)
+MAX_MAP_POINTS = 2000
+CLUSTER_PIXELS = 40  # Approximate width of a cluster on screen
+DEFAULT_ZOOM = 11
+
+# Rows sent to the browser at once by the tables (see get_table)
+PAGE_SIZE = 25
+
+# Operators of the DataTable filter syntax, and their pandas equivalent
+FILTER_OPERATORS = [
+    ('s>=', 'ge'), ('>=', 'ge'),
+    ('s<=', 'le'), ('<=', 'le'),
+    ('s<', 'lt'), ('<', 'lt'),
+    ('s>', 'gt'), ('>', 'gt'),
+    ('s!=', 'ne'), ('!=', 'ne'),
+    ('s=', 'eq'), ('=', 'eq'),
+    ('contains', 'contains'),
+    ('datestartswith', 'datestartswith'),
+    ]
+
+# Memory budget of the data store (see get_data)
+MAX_STORE_BYTES = 1024**3
+
+# Cleaned frames by file, least recently used first, and their size
+_store = OrderedDict()
+_store_bytes = 0
+# Loads in progress, so that concurrent callbacks wait for the same one
+_in_flight = {}
+_store_lock = threading.Lock()
 
 
 def prepare_data(file):
@@ -20,72 +82,112 @@ def prepare_data(file):
     df: pd.DataFrame
         The cleaned data.
     """
-    df = pd.read_csv(file, compression="gzip", low_memory=False)
-    df = df[df.nature_mutation == "Vente"]
-    df = df.drop([
-        'numero_disposition',
-        'nature_mutation',
-        'adresse_code_voie',
-        'code_commune',
-        'ancien_code_commune',
-        'ancien_nom_commune',
-        'id_parcelle',
-        'ancien_id_parcelle',
-        'numero_volume',
-        'lot1_numero',
-        'lot2_numero',
-        'lot3_numero',
-        'lot4_numero',
-        'lot5_numero',
-        'lot1_surface_carrez',
-        'lot2_surface_carrez',
-        'lot3_surface_carrez',
-        'lot4_surface_carrez',
-        'lot5_surface_carrez',
-        'nombre_lots',
-        'code_type_local',
-        'code_nature_culture',
-        'nature_culture',
-        'code_nature_culture_speciale',
-        'nature_culture_speciale',
-        'surface_terrain',
-        'code_departement',
-        'nom_commune',
-        ], axis=1)
+    # Sales are selected while reading, so other rows are never in memory
+    df = read_dvf(file, columns=COLUMNS, filters={'nature_mutation': "Vente"})
     df = df.dropna()
 
     df['type_local'] = df['type_local'].apply(
         lambda x: "Local" if x.startswith("Local") else x
-    )
+    ).astype("category")
 
     return df
 
 
-def get_map(df):
-    """Return a plotly map with the data."""
-
-    # Generate texts for the markers
-    # Add to the text:
-    # - the surface of the building
-    # - the number of rooms
-    # - the type of building
-    # - the price
-    # - the address
-    text = [
-        f"Surface: {surface} m²\n"
-        f"Rooms: {rooms}\n"
-        f"Type: {type_local}\n"
-        f"Price: {price} €\n"
-        f"Address: {int(number):d} {address}"
-        for surface, rooms, type_local, price, address, number in zip(
-            df["surface_reelle_bati"],
-            df["nombre_pieces_principales"],
-            df["type_local"],
-            df["valeur_fonciere"],
-            df["adresse_nom_voie"],
-            df["adresse_numero"]
-        )
+def get_viewport(relayout_data):
+    """
+    Read the viewport of a map from its relayoutData.
+
+    Returns:
+    --------
+    viewport: dict or None
+        The "center", "zoom" and "bounds" (lon_min, lat_min, lon_max,
+        lat_max) of the map, or None if relayoutData does not hold them
+        (e.g. before the first move).
+    """
+    if not relayout_data or 'mapbox.zoom' not in relayout_data:
+        return None
+    viewport = {
+        'center': relayout_data.get('mapbox.center'),
+        'zoom': relayout_data['mapbox.zoom'],
+        'bounds': None,
+    }
+    derived = relayout_data.get('mapbox._derived')
+    if derived and derived.get('coordinates'):
+        lons, lats = zip(*derived['coordinates'])
+        viewport['bounds'] = (min(lons), min(lats), max(lons), max(lats))
+    return viewport
+
+
+def get_clusters(df, zoom, cell_pixels=CLUSTER_PIXELS):
+    """
+    Group the points into square cells of about cell_pixels pixels at the
+    given zoom level.
+
+    Returns:
+    --------
+    clusters: pd.DataFrame
+        One row per non-empty cell, with its number of sales ("count"),
+        the mean position of its points and their median price.
+    """
+    # At zoom z, the 256 pixels of a tile span 360 / 2**z degrees
+    cell = 360 / 2**zoom * cell_pixels / 256
+    keys = [
+        np.floor(df["longitude"].values / cell),
+        np.floor(df["latitude"].values / cell),
     ]
+    return df.groupby(keys).agg(
+        count=("valeur_fonciere", "size"),
+        latitude=("latitude", "mean"),
+        longitude=("longitude", "mean"),
+        valeur_fonciere=("valeur_fonciere", "median"),
+    ).reset_index(drop=True)
+
+
+def get_map(df, viewport=None, max_points=MAX_MAP_POINTS):
+    """
+    Return a plotly map with the data.
+
+    Only the points inside the viewport (see get_viewport) are drawn.
+    If there are more than max_points of them, they are grouped into
+    clusters, which are split again as the user zooms in.
+
+    The customdata of each point is its row key in df, to be passed to
+    get_property. Clusters have no customdata.
+    """
+    if viewport is None:
+        # Compute as center the mean of the coordinates
+        viewport = {
+            'center': {"lat": df["latitude"].mean(),
+                       "lon": df["longitude"].mean()},
+            'zoom': DEFAULT_ZOOM,
+            'bounds': None,
+        }
+    if viewport['bounds'] is not None:
+        lon_min, lat_min, lon_max, lat_max = viewport['bounds']
+        df = df[
+            df["longitude"].between(lon_min, lon_max)
+            & df["latitude"].between(lat_min, lat_max)
+        ]
+
+    if len(df) <= max_points:
+        # Each point only carries its row key, the details are looked up
+        # on the server when it is clicked (see get_property)
+        customdata = df.index.values
+        hovertext = None
+        marker = go.scattermapbox.Marker(size=9)
+    else:
+        df = get_clusters(df, viewport['zoom'])
+        customdata = None
+        hovertext = [
+            f"Sales: {count}<br>Median price: {price:.0f} €"
+            for count, price in zip(df["count"], df["valeur_fonciere"])
+        ]
+        # The area of a cluster grows with its number of sales
+        marker = go.scattermapbox.Marker(
+            size=9 + 3 * np.sqrt(df["count"].values),
+            sizemode="diameter",
+            opacity=0.7
+        )
 
     # Plot figure
     fig = go.Figure(
@@ -93,20 +195,246 @@ def get_map(df):
             lat=df["latitude"],
             lon=df["longitude"],
             mode='markers',
-            marker=go.scattermapbox.Marker(
-                size=9
-            ),
-            customdata=text,
+            marker=marker,
+            customdata=customdata,
+            hovertext=hovertext,
         )
     )
-    # Compute as center the mean of the coordinates
-    center_lat = df["latitude"].mean()
-    center_lon = df["longitude"].mean()
     fig.update_layout(
         height=800,
         mapbox_style="open-street-map",
-        mapbox_zoom=11,
-        mapbox_center={"lat": center_lat, "lon": center_lon}
+        mapbox_zoom=viewport['zoom'],
+        mapbox_center=viewport['center'],
+        # Keep the user's view when the figure is redrawn
+        uirevision="map"
         )
 
     return fig
+
+
+def format_property(row):
+    """
+    Return the lines describing a sale, for the info panel.
+
+    The lines give:
+    - the surface of the building
+    - the number of rooms
+    - the type of building
+    - the price
+    - the address
+    """
+    return [
+        f"Surface: {row.surface_reelle_bati} m²",
+        f"Rooms: {row.nombre_pieces_principales}",
+        f"Type: {row.type_local}",
+        f"Price: {row.valeur_fonciere} €",
+        f"Address: {int(row.adresse_numero):d} {row.adresse_nom_voie}",
+    ]
+
+
+def get_table(table_id, columns=COLUMNS, page_size=PAGE_SIZE):
+    """
+    Return an empty DataTable paged, sorted and filtered by the server.
+
+    The rows are filled in by a callback using query_table, so that the
+    browser only receives the page being displayed.
+    """
+    return dash_table.DataTable(
+        id=table_id,
+        columns=[{"name": i, "id": i} for i in columns],
+        data=[],
+        page_current=0,
+        page_size=page_size,
+        page_count=1,
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
+    )
+
+
+def _split_filter_part(part):
+    """
+    Parse one condition of a DataTable filter query, e.g.
+    "{valeur_fonciere} s> 500000".
+
+    Returns:
+    --------
+    condition: tuple
+        (column, operator, value), or (None, None, None) if the condition
+        cannot be parsed. The value is the string typed by the user (see
+        _compare for its conversion).
+    """
+    for token, operator in FILTER_OPERATORS:
+        if token not in part:
+            continue
+        name, value = part.split(token, 1)
+        name = name.strip()
+        if not (name.startswith('{') and name.endswith('}')):
+            continue
+        value = value.strip()
+        if value[:1] == value[-1:] and value[:1] in ("'", '"', '`'):
+            value = value[1:-1].replace('\\' + value[0], value[0])
+        return name[1:-1], operator, value
+    return None, None, None
+
+
+def _compare(series, operator, value):
+    """
+    Compare a column to the value of a filter condition.
+
+    The value is converted to the type of the column: numbers for numeric
+    columns, strings for the others.
+
+    Returns:
+    --------
+    mask: pd.Series or None
+        The rows matching the condition, or None if the value does not
+        fit the column (e.g. text on a numeric column), in which case the
+        condition is ignored.
+    """
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+        return getattr(series, operator)(value)
+    # Missing values never match, and the others are compared as text
+    return series.notna() & getattr(series.astype(str), operator)(value)
+
+
+def query_table(df, page_current=0, page_size=PAGE_SIZE, sort_by=None,
+                filter_query=''):
+    """
+    Apply the filter, sort and page of a DataTable to a DataFrame.
+
+    Parameters:
+    -----------
+    df: pd.DataFrame
+        The full data (not modified).
+
+    page_current, page_size: int
+        The page displayed by the table, and its number of rows.
+
+    sort_by: list
+        The sort_by property of the table.
+
+    filter_query: str
+        The filter_query property of the table.
+
+    Returns:
+    --------
+    data: list
+        The rows of the page, as records.
+
+    page_count: int
+        The number of pages of the filtered data.
+    """
+    for part in (filter_query or '').split(' && '):
+        column, operator, value = _split_filter_part(part)
+        if column not in df.columns:
+            continue
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            mask = _compare(df[column], operator, value)
+            if mask is not None:
+                df = df.loc[mask]
+        elif operator == 'contains':
+            df = df.loc[df[column].astype(str).str.contains(
+                value, case=False, regex=False
+                )]
+        elif operator == 'datestartswith':
+            df = df.loc[df[column].astype(str).str.startswith(value)]
+
+    sort_by = [col for col in sort_by or [] if col['column_id'] in df.columns]
+    if sort_by:
+        df = df.sort_values(
+            [col['column_id'] for col in sort_by],
+            ascending=[col['direction'] == 'asc' for col in sort_by],
+            # Categories are sorted by name, not by order of appearance
+            key=lambda s: s.astype(str)
+            if isinstance(s.dtype, pd.CategoricalDtype) else s,
+            kind='stable',
+            )
+
+    page_count = max(1, math.ceil(len(df) / page_size))
+    page = min(page_current or 0, page_count - 1)
+    rows = df.iloc[page * page_size:(page + 1) * page_size]
+    return rows.to_dict('records'), page_count
+
+
+def get_data(file):
+    """
+    Return the cleaned data for a file, shared by all the callbacks.
+
+    The result of prepare_data is kept in memory for the whole process,
+    so the table and the map callbacks (and every later visit to the same
+    year) reuse the same DataFrame. If several callbacks ask for a file
+    that is being loaded, they all wait for that single load. The least
+    recently used frames are dropped once MAX_STORE_BYTES is exceeded.
+
+    The returned DataFrame is shared: do not modify it.
+
+    Parameters:
+    -----------
+    file: str
+        The path or URL to the CSV file containing the data.
+
+    Returns:
+    --------
+    df: pd.DataFrame
+        The cleaned data.
+    """
+    global _store_bytes
+
+    with _store_lock:
+        if file in _store:
+            _store.move_to_end(file)
+            return _store[file][0]
+        future = _in_flight.get(file)
+        loading = future is None
+        if loading:
+            future = _in_flight[file] = Future()
+
+    if not loading:
+        return future.result()
+
+    try:
+        df = prepare_data(file)
+    except Exception as err:
+        with _store_lock:
+            del _in_flight[file]
+        future.set_exception(err)
+        raise
+
+    nbytes = int(df.memory_usage(deep=True).sum())
+    with _store_lock:
+        del _in_flight[file]
+        _store[file] = (df, nbytes)
+        _store_bytes += nbytes
+        # Always keep the frame we just loaded
+        while _store_bytes > MAX_STORE_BYTES and len(_store) > 1:
+            _, (_, dropped) = _store.popitem(last=False)
+            _store_bytes -= dropped
+    future.set_result(df)
+    return df
+
+
+def get_property(file, key):
+    """
+    Return one sale of a file by its row key (the customdata of the map).
+
+    The lookup uses the index of the shared DataFrame of get_data, so the
+    data is not scanned.
+
+    Returns:
+    --------
+    row: pd.Series or None
+        The sale, or None if there is no row with that key.
+    """
+    df = get_data(file)
+    try:
+        return df.loc[key]
+    except KeyError:
+        return None
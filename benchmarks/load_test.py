@@ -0,0 +1,386 @@
+"""
+Measure the latency of the callbacks of 3_dash/app3.py under many
+simultaneous users, without any network access.
+
+The harness:
+- writes synthetic DVF files (see synthetic_dvf.py) for each year and
+  serves them from a local HTTP server, laid out like data.gouv.fr,
+- starts app3 in a subprocess, pointed at that server through the
+  DVF_BASE_URL environment variable (with an empty DVF cache),
+- runs N sessions in parallel, each changing the year (which fires the
+  table and map callbacks) and clicking on a property of the map, by
+  posting to the Dash callback endpoint like the browser does (when the
+  map shows clusters, the session first zooms in on one of them),
+- reports the p50/p95/p99 latency and the throughput of each callback.
+
+Usage:
+------
+    python load_test.py --sessions 20 --iterations 10
+"""
+
+import argparse
+import base64
+import functools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+from synthetic_dvf import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "3_dash")
+
+YEARS = ['2020', '2021', '2022', '2023']  # The options of year-dd
+ROWS = 100_000  # Rows of each synthetic file
+SESSIONS = 10
+ITERATIONS = 5
+STARTUP_TIMEOUT = 60  # In seconds
+PAGE_SIZE = 25
+MAX_ZOOMS = 6  # Zooms in on a cluster before giving up
+CLUSTER_PIXELS = 40  # Width of the cells of the clusters (see common.py)
+
+CALLBACK_URL = "/_dash-update-component"
+
+
+def get_free_port():
+    """Return a TCP port nobody listens to."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serve files without logging every request."""
+
+    def log_message(self, *args):
+        pass
+
+
+def start_data_server(folder, rows=ROWS, years=YEARS):
+    """
+    Write the synthetic files under folder and serve them.
+
+    Returns:
+    --------
+    server: ThreadingHTTPServer
+        The server, running in a background thread.
+    base_url: str
+        The URL to pass as DVF_BASE_URL.
+    """
+    for year in years:
+        path = os.path.join(folder, year, "departements", "75.csv.gz")
+        if not os.path.exists(path):
+            generate(rows, path, seed=int(year), year=int(year))
+
+    handler = functools.partial(QuietHandler, directory=folder)
+    server = ThreadingHTTPServer(("127.0.0.1", get_free_port()), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def start_app(base_url, cache_dir, port):
+    """Start app3 in a subprocess and wait until it answers."""
+    env = dict(
+        os.environ,
+        DVF_BASE_URL=base_url,
+        DVF_CACHE_DIR=cache_dir,
+        )
+    process = subprocess.Popen(
+        [sys.executable, "-c",
+         f"import app3; app3.app.run(port={port}, threaded=True)"],
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(process.stderr.read().decode())
+        try:
+            requests.get(url, timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"The app did not start within {STARTUP_TIMEOUT} s")
+
+
+def _prop(component, prop, value=None):
+    """Return a property of a component as the callback payload has it."""
+    return {"id": component, "property": prop, "value": value}
+
+
+def table_payload(year):
+    """The request sent when the year changes, for the table."""
+    return {
+        "output": "..table.data...table.page_count..",
+        "outputs": [
+            {"id": "table", "property": "data"},
+            {"id": "table", "property": "page_count"},
+        ],
+        "inputs": [
+            _prop("year-dd", "value", year),
+            _prop("table", "page_current", 0),
+            _prop("table", "page_size", PAGE_SIZE),
+            _prop("table", "sort_by", []),
+            _prop("table", "filter_query", ""),
+        ],
+        "changedPropIds": ["year-dd.value"],
+    }
+
+
+def map_payload(year, relayout_data=None):
+    """
+    The request sent when the year changes, for the map, or when the
+    map moves (with its relayoutData).
+    """
+    return {
+        "output": "map.figure",
+        "outputs": {"id": "map", "property": "figure"},
+        "inputs": [
+            _prop("year-dd", "value", year),
+            _prop("map", "relayoutData", relayout_data),
+        ],
+        "changedPropIds": [
+            "year-dd.value" if relayout_data is None else "map.relayoutData"
+        ],
+    }
+
+
+def zoom_relayout(lat, lon, zoom, box):
+    """The relayoutData of the map zoomed in around (lat, lon)."""
+    return {
+        "mapbox.center": {"lat": lat, "lon": lon},
+        "mapbox.zoom": zoom,
+        "mapbox._derived": {"coordinates": [
+            [lon - box, lat + box], [lon + box, lat + box],
+            [lon + box, lat - box], [lon - box, lat - box],
+        ]},
+    }
+
+
+def click_payload(year, key):
+    """The request sent when the property with row key is clicked."""
+    point = {"customdata": key}
+    return {
+        "output": "info.children",
+        "outputs": {"id": "info", "property": "children"},
+        "inputs": [_prop("map", "clickData", {"points": [point]})],
+        "state": [_prop("year-dd", "value", year)],
+        "changedPropIds": ["map.clickData"],
+    }
+
+
+def call(session, url, name, payload, latencies):
+    """Post a callback request and record its latency under name."""
+    start = time.perf_counter()
+    response = session.post(url + CALLBACK_URL, json=payload, timeout=120)
+    latencies.append((name, time.perf_counter() - start))
+    response.raise_for_status()
+    return response.json()
+
+
+def decode(values):
+    """
+    Return the values of a property of a figure as a list.
+
+    Recent plotly versions send numpy arrays in binary form, as
+    {"dtype": ..., "bdata": <base64>, "shape": ...}.
+    """
+    if isinstance(values, dict) and "bdata" in values:
+        array = np.frombuffer(
+            base64.b64decode(values["bdata"]), dtype=values["dtype"]
+            )
+        if "shape" in values:
+            array = array.reshape(
+                [int(n) for n in str(values["shape"]).split(",")]
+                )
+        return array.tolist()
+    return list(values or [])
+
+
+def get_trace(answer):
+    """Return the first trace of a map answer (an empty dict if none)."""
+    traces = answer["response"]["map"]["figure"]["data"]
+    return traces[0] if traces else {}
+
+
+def get_keys(answer):
+    """
+    Return the row keys of the points of a map answer, or an empty list
+    if the map shows clusters (which have no keys).
+    """
+    return decode(get_trace(answer).get("customdata"))
+
+
+def zoom_to_points(session, url, year, answer, rng, latencies):
+    """
+    Zoom in on random clusters of the map until it shows properties, like
+    a user looking for one to click.
+
+    Returns:
+    --------
+    keys: list
+        The row keys of the properties shown.
+    """
+    for _ in range(MAX_ZOOMS):
+        trace = get_trace(answer)
+        lats, lons = decode(trace.get("lat")), decode(trace.get("lon"))
+        if not lats:
+            break
+        i = rng.randrange(len(lats))
+        # The points of a cluster are in a cell of CLUSTER_PIXELS pixels
+        # around it: show that cell and its neighbours
+        zoom = answer["response"]["map"]["figure"]["layout"]["mapbox"]["zoom"]
+        box = 360 / 2**zoom * CLUSTER_PIXELS / 256
+        answer = call(
+            session, url, "update_map (zoom)",
+            map_payload(year, zoom_relayout(lats[i], lons[i], zoom + 2, box)),
+            latencies
+            )
+        keys = get_keys(answer)
+        if keys:
+            return keys
+    raise RuntimeError(
+        f"The map of {year} shows no property to click, even zoomed in: "
+        "the clicks would not measure get_property"
+        )
+
+
+def run_session(url, iterations, seed, latencies):
+    """Change the year and click on the map, iterations times."""
+    rng = random.Random(seed)
+    with requests.Session() as session:
+        for _ in range(iterations):
+            year = rng.choice(YEARS)
+            call(session, url, "update_output", table_payload(year),
+                 latencies)
+            answer = call(session, url, "update_map", map_payload(year),
+                          latencies)
+            keys = get_keys(answer)
+            if not keys:
+                keys = zoom_to_points(session, url, year, answer, rng,
+                                      latencies)
+            answer = call(session, url, "display_click_data",
+                          click_payload(year, rng.choice(keys)), latencies)
+            info = answer["response"]["info"]["children"]
+            if "Zoom in" in json.dumps(info):
+                raise RuntimeError(
+                    "A click on a property did not select it: the clicks "
+                    "would not measure get_property"
+                    )
+
+
+def summarize(latencies, duration):
+    """
+    Return the latency percentiles (in ms) and throughput per callback.
+    """
+    report = {}
+    for name in sorted({name for name, _ in latencies}):
+        values = np.array([t for n, t in latencies if n == name]) * 1000
+        report[name] = {
+            'requests': len(values),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99)),
+            'throughput_rps': len(values) / duration,
+        }
+    return report
+
+
+def load_test(sessions=SESSIONS, iterations=ITERATIONS, rows=ROWS,
+              warmup=True):
+    """
+    Run the whole load test.
+
+    Parameters:
+    -----------
+    sessions: int
+        The number of users acting at the same time.
+    iterations: int
+        The number of (year change, click) rounds of each user.
+    rows: int
+        The number of rows of each synthetic file.
+    warmup: bool
+        Whether each year is loaded once before the measures, so that the
+        first loads of the data are not counted.
+
+    Returns:
+    --------
+    report: dict
+        Callback name -> requests, p50/p95/p99 latency and throughput.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        server, base_url = start_data_server(
+            os.path.join(folder, "files"), rows
+            )
+        process = None
+        try:
+            process, url = start_app(
+                base_url, os.path.join(folder, "cache"), get_free_port()
+                )
+            if warmup:
+                with requests.Session() as session:
+                    for year in YEARS:
+                        call(session, url, "warmup", map_payload(year), [])
+
+            latencies = []
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=sessions) as pool:
+                futures = [
+                    pool.submit(run_session, url, iterations, seed, latencies)
+                    for seed in range(sessions)
+                    ]
+                for future in futures:
+                    future.result()
+            duration = time.perf_counter() - start
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+            server.shutdown()
+    return summarize(latencies, duration)
+
+
+def main():
+    """
+    Run the load test from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=SESSIONS)
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--rows", type=int, default=ROWS,
+                        help="rows of each synthetic file")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false",
+                        help="count the first load of each year")
+    parser.add_argument("--output", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    report = load_test(args.sessions, args.iterations, args.rows,
+                       args.warmup)
+    print(f"{'callback':20} {'requests':>8} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'req/s':>8}")
+    for name, r in report.items():
+        print(f"{name:20} {r['requests']:>8} {r['p50_ms']:9.1f} "
+              f"{r['p95_ms']:9.1f} {r['p99_ms']:9.1f} "
+              f"{r['throughput_rps']:8.1f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
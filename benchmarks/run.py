@@ -0,0 +1,193 @@
+"""
+Time the data functions of the apps on synthetic DVF files, and store
+the results as JSON so that two versions can be compared.
+
+The files are generated once per size (see synthetic_dvf.py) and kept in
+the data folder.
+
+Usage:
+------
+    python run.py --sizes 10000 100000 1000000
+    python run.py --compare results/old.json results/new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from synthetic_dvf import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "benchmarks", "data")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# The apps import their modules from their own folder
+sys.path[:0] = [
+    os.path.join(ROOT, "3_dash"),
+    os.path.join(ROOT, "2_streamlit", "2_real_estate_comparables"),
+]
+import common  # noqa: E402
+import comparables  # noqa: E402
+
+SIZES = [10_000, 100_000]
+REPEATS = 3
+SLOWER = 1.1  # Ratio above which a comparison is flagged
+
+
+def get_file(rows, data_dir=DATA_DIR):
+    """Return the synthetic file of the given size, generating it once."""
+    path = os.path.join(data_dir, f"{rows}.csv.gz")
+    if not os.path.exists(path):
+        generate(rows, path)
+    return path
+
+
+def measure(function, repeats=REPEATS):
+    """
+    Call function repeats times.
+
+    Returns:
+    --------
+    timing: dict
+        The min and median duration in seconds, and the last result.
+    """
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return {
+        'min_s': min(durations),
+        'median_s': statistics.median(durations),
+        'result': result,
+    }
+
+
+def get_benchmarks(file):
+    """
+    Yield (name, function) for each benchmark on a file.
+
+    The functions whose input is the output of another one get it from
+    that one, computed outside of the timing.
+    """
+    yield "common.prepare_data", lambda: common.prepare_data(file)
+    df = common.prepare_data(file)
+    yield "common.get_map", lambda: common.get_map(df)
+    yield "DataFrame.to_dict('records')", lambda: df.to_dict('records')
+
+    yield "comparables.prepare_data", lambda: comparables.prepare_data(file)
+    train, test = comparables.prepare_data(file)
+    row = test.head(1)
+    yield "comparables.get_similarities", \
+        lambda: comparables.get_similarities(train, row)
+    features = comparables.get_features(train)
+    yield "comparables.get_similarities (cached features)", \
+        lambda: comparables.get_similarities(train, row, features)
+
+
+def get_metadata():
+    """Return what identifies the code and the machine of a run."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run(sizes=SIZES, repeats=REPEATS, data_dir=DATA_DIR):
+    """
+    Run every benchmark on a file of each size.
+
+    Returns:
+    --------
+    report: dict
+        The metadata of the run and one result per (benchmark, size).
+    """
+    results = []
+    for rows in sizes:
+        file = get_file(rows, data_dir)
+        for name, function in get_benchmarks(file):
+            timing = measure(function, repeats)
+            del timing['result']
+            results.append({'benchmark': name, 'rows': rows,
+                            'repeats': repeats, **timing})
+            print(f"{name:50} {rows:>9,} rows {timing['min_s']:9.4f} s")
+    return {'metadata': get_metadata(), 'results': results}
+
+
+def compare(old, new):
+    """
+    Print the ratio of the new to the old minimum durations, flagging
+    the benchmarks at least SLOWER times slower.
+    """
+    before = {(r['benchmark'], r['rows']): r['min_s'] for r in old['results']}
+    print(f"{old['metadata']['commit']} -> {new['metadata']['commit']}")
+    for r in new['results']:
+        key = (r['benchmark'], r['rows'])
+        if key not in before:
+            continue
+        ratio = r['min_s'] / before[key]
+        flag = "  SLOWER" if ratio >= SLOWER else ""
+        print(f"{r['benchmark']:50} {r['rows']:>9,} rows "
+              f"{before[key]:9.4f} s -> {r['min_s']:9.4f} s "
+              f"(x{ratio:.2f}){flag}")
+
+
+def main():
+    """
+    Run the benchmarks, or compare two results, from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="numbers of rows of the files")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--data-dir", default=DATA_DIR,
+                        help="where the synthetic files are kept")
+    parser.add_argument("--output",
+                        help="JSON file of the results "
+                             "(default: results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two JSON files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        compare(old, new)
+        return
+
+    report = run(args.sizes, args.repeats, args.data_dir)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{report['metadata']['commit'] or 'results'}.json"
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Generate synthetic DVF files (Demandes de Valeurs Foncières) for the
+benchmarks.
+
+The files have the columns, types and layout of the real ones
+(gzip CSV, one row per lot of a sale), with random but plausible values
+around Paris, so the apps can read them like the files of data.gouv.fr.
+
+Usage:
+------
+    python synthetic_dvf.py 100000 data/100000.csv.gz
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 500_000  # Rows generated and written at once
+
+# The columns of the real files, in order
+COLUMNS = [
+    'id_mutation', 'date_mutation', 'numero_disposition', 'nature_mutation',
+    'valeur_fonciere', 'adresse_numero', 'adresse_suffixe',
+    'adresse_nom_voie', 'adresse_code_voie', 'code_postal', 'code_commune',
+    'nom_commune', 'code_departement', 'ancien_code_commune',
+    'ancien_nom_commune', 'id_parcelle', 'ancien_id_parcelle',
+    'numero_volume', 'lot1_numero', 'lot1_surface_carrez', 'lot2_numero',
+    'lot2_surface_carrez', 'lot3_numero', 'lot3_surface_carrez',
+    'lot4_numero', 'lot4_surface_carrez', 'lot5_numero',
+    'lot5_surface_carrez', 'nombre_lots', 'code_type_local', 'type_local',
+    'surface_reelle_bati', 'nombre_pieces_principales',
+    'code_nature_culture', 'nature_culture', 'code_nature_culture_speciale',
+    'nature_culture_speciale', 'surface_terrain', 'longitude', 'latitude',
+    ]
+
+NATURES = ["Vente", "Vente en l'état futur d'achèvement", "Echange",
+           "Adjudication", "Vente terrain à bâtir", "Expropriation"]
+NATURE_WEIGHTS = [0.9, 0.05, 0.02, 0.01, 0.01, 0.01]
+
+TYPES = ["Appartement", "Dépendance", "Maison",
+         "Local industriel. commercial ou assimilé"]
+TYPE_CODES = [2, 3, 1, 4]
+TYPE_WEIGHTS = [0.55, 0.3, 0.05, 0.1]
+
+STREET_TYPES = ["RUE", "AV", "BD", "PL", "QUAI", "IMP", "PAS", "VLA"]
+STREET_NAMES = [
+    "DE RIVOLI", "DE LA PAIX", "VICTOR HUGO", "DES LILAS", "SAINT HONORE",
+    "DU BAC", "DE VAUGIRARD", "MONTMARTRE", "DE BELLEVILLE", "VOLTAIRE",
+    "DE LA REPUBLIQUE", "JEAN JAURES", "DES ECOLES", "MOUFFETARD",
+    "DE CHARONNE", "LECOURBE", "DE CLICHY", "OBERKAMPF", "D ALESIA",
+    "DE LA CONVENTION",
+    ]
+
+CENTER = (48.8566, 2.3522)  # Latitude, longitude
+SPREAD = (0.03, 0.045)  # Standard deviation, in degrees
+
+
+def _missing(rng, values, rate):
+    """Replace a fraction of the values by NaN."""
+    values = values.astype(np.float64)
+    values[rng.random(len(values)) < rate] = np.nan
+    return values
+
+
+def generate_chunk(rng, size, start=0, year=2022, department=75):
+    """
+    Return size synthetic rows, numbered from start.
+
+    Several consecutive rows share a mutation, like the lots of one sale
+    in the real files.
+    """
+    # About 1.6 rows per mutation
+    mutation = start + np.cumsum(rng.random(size) < 0.6)
+    days = rng.integers(0, 365, mutation[-1] - start + 2)[mutation - start]
+    dates = (
+        np.datetime64(f"{year}-01-01") + days.astype("timedelta64[D]")
+        ).astype(str)
+
+    type_index = rng.choice(len(TYPES), size, p=TYPE_WEIGHTS)
+    has_type = rng.random(size) > 0.15
+    is_built = has_type & (type_index != 1)
+
+    surface = np.round(rng.lognormal(3.9, 0.5, size))
+    rooms = np.clip(np.round(surface / 20 + rng.normal(0, 0.7, size)), 1, 12)
+    price = np.round(surface * rng.lognormal(9.2, 0.35, size), -2)
+
+    street = rng.integers(0, len(STREET_TYPES) * len(STREET_NAMES), size)
+    street_names = np.array([
+        f"{kind} {name}" for kind in STREET_TYPES for name in STREET_NAMES
+        ])
+    arrondissement = rng.integers(1, 21, size)
+
+    latitude = np.round(CENTER[0] + rng.normal(0, SPREAD[0], size), 6)
+    longitude = np.round(CENTER[1] + rng.normal(0, SPREAD[1], size), 6)
+    no_position = rng.random(size) < 0.02
+
+    empty = np.full(size, np.nan)
+    return pd.DataFrame({
+        'id_mutation': [f"{year}-{m}" for m in mutation],
+        'date_mutation': dates,
+        'numero_disposition': np.ones(size),
+        'nature_mutation': rng.choice(NATURES, size, p=NATURE_WEIGHTS),
+        'valeur_fonciere': _missing(rng, price, 0.01),
+        'adresse_numero': _missing(rng, rng.integers(1, 200, size), 0.02),
+        'adresse_suffixe': np.where(rng.random(size) < 0.03, "B", None),
+        'adresse_nom_voie': street_names[street],
+        'adresse_code_voie': [f"{s:04d}" for s in street],
+        'code_postal': 75000.0 + arrondissement,
+        'code_commune': [f"751{a:02d}" for a in arrondissement],
+        'nom_commune': [f"Paris {a}e Arrondissement" for a in arrondissement],
+        'code_departement': department,
+        'ancien_code_commune': empty,
+        'ancien_nom_commune': empty,
+        'id_parcelle': [f"751{a:02d}000AB{s:04d}"
+                        for a, s in zip(arrondissement, street)],
+        'ancien_id_parcelle': empty,
+        'numero_volume': empty,
+        'lot1_numero': _missing(rng, rng.integers(1, 500, size), 0.3),
+        'lot1_surface_carrez': _missing(rng, surface, 0.6),
+        'lot2_numero': _missing(rng, rng.integers(1, 500, size), 0.7),
+        'lot2_surface_carrez': _missing(rng, surface, 0.9),
+        'lot3_numero': empty,
+        'lot3_surface_carrez': empty,
+        'lot4_numero': empty,
+        'lot4_surface_carrez': empty,
+        'lot5_numero': empty,
+        'lot5_surface_carrez': empty,
+        'nombre_lots': rng.integers(0, 3, size),
+        'code_type_local': np.where(
+            has_type, np.array(TYPE_CODES)[type_index], np.nan
+            ),
+        'type_local': np.where(has_type, np.array(TYPES)[type_index], None),
+        'surface_reelle_bati': np.where(is_built, surface, np.nan),
+        'nombre_pieces_principales': np.where(is_built, rooms, np.nan),
+        'code_nature_culture': empty,
+        'nature_culture': empty,
+        'code_nature_culture_speciale': empty,
+        'nature_culture_speciale': empty,
+        'surface_terrain': empty,
+        'longitude': np.where(no_position, np.nan, longitude),
+        'latitude': np.where(no_position, np.nan, latitude),
+        }, columns=COLUMNS)
+
+
+def generate(rows, path, seed=0, year=2022, department=75,
+             chunk_size=CHUNK_SIZE):
+    """
+    Write a synthetic DVF file of the given number of rows.
+
+    The rows are generated and written chunk by chunk, so large files do
+    not need to fit in memory.
+
+    Parameters:
+    -----------
+    rows: int
+        The number of rows.
+    path: str
+        Where to write the file (gzip CSV).
+    seed: int
+        The seed of the random generator (same seed, same file).
+    year, department: int
+        The year of the sales and their department.
+
+    Returns:
+    --------
+    path: str
+        The path to the file.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    for start in range(0, rows, chunk_size):
+        chunk = generate_chunk(
+            rng, min(chunk_size, rows - start), start, year, department
+            )
+        # Appended gzip members make a valid gzip file
+        chunk.to_csv(
+            path,
+            mode="w" if start == 0 else "a",
+            header=start == 0,
+            index=False,
+            compression="gzip"
+            )
+    return path
+
+
+def main():
+    """
+    Write a synthetic file from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("rows", type=int, help="number of rows")
+    parser.add_argument("path", help="where to write the file (.csv.gz)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.rows, args.path, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""
+This module contains helpers to load the DVF files (Demandes de Valeurs
+Foncières) published on data.gouv.fr. It is shared by all the real
+estate apps, which add the root of the repository to their path.
+
+Each (year, department) file is downloaded once and stored locally as
+Parquet, which is much faster to read than the original gzip CSV.
+Once the local copy is older than REVALIDATE_AFTER seconds, the server
+is asked whether the file changed (ETag / Last-Modified) and it is only
+downloaded again if it did.
+
+The cache folder can be changed with the DVF_CACHE_DIR environment
+variable, and the server with DVF_BASE_URL (e.g. a local copy of the
+files, for tests).
+
+The files are parsed with the types declared in NUMERIC_COLUMNS and
+CATEGORY_COLUMNS (all other columns are strings), and the loaders take
+a list of columns so that each app only reads what it uses.
+
+Files are read in chunks of CHUNK_SIZE rows, and the loaders take
+equality filters (e.g. {"nature_mutation": "Vente"}) that are applied
+chunk by chunk, so the full file is never held in memory.
+
+load_many loads several years and departments at once, in parallel, and
+get_version tells the apps when the data of a file changed.
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BASE_URL = os.environ.get(
+    "DVF_BASE_URL",
+    "https://files.data.gouv.fr/geo-dvf/latest/csv"
+)
+CACHE_DIR = os.environ.get(
+    "DVF_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "dvf")
+)
+REVALIDATE_AFTER = 24 * 3600  # In seconds
+
+CHUNK_SIZE = 100_000  # Rows read at once (one Parquet row group each)
+MAX_WORKERS = 8  # Files loaded at the same time by load_many
+
+# Bump this when the types below change, so cached files are rebuilt
+SCHEMA_VERSION = 3
+
+# Columns parsed as numbers (they all have missing values, hence float)
+NUMERIC_COLUMNS = [
+    'numero_disposition',
+    'valeur_fonciere',
+    'adresse_numero',
+    'code_postal',
+    'lot1_surface_carrez',
+    'lot2_surface_carrez',
+    'lot3_surface_carrez',
+    'lot4_surface_carrez',
+    'lot5_surface_carrez',
+    'nombre_lots',
+    'code_type_local',
+    'surface_reelle_bati',
+    'nombre_pieces_principales',
+    'surface_terrain',
+    'longitude',
+    'latitude',
+    ]
+
+# String columns with few distinct values, stored as categories
+CATEGORY_COLUMNS = [
+    'nature_mutation',
+    'adresse_nom_voie',
+    'nom_commune',
+    'type_local',
+    ]
+
+# Matches ".../{year}/departements/{department}.csv.gz"
+URL_PATTERN = re.compile(r"/(\d{4})/departements/(\w+)\.csv\.gz$")
+
+
+def get_url(year, department, base_url=BASE_URL):
+    """Return the URL to the CSV file for the given year and department."""
+    return f"{base_url}/{year}/departements/{department}.csv.gz"
+
+
+def get_dtypes(columns=None):
+    """
+    Return the dtype of each DVF column, to be passed to pd.read_csv.
+
+    Parameters:
+    -----------
+    columns: list
+        The columns to return the types for. Defaults to all of them.
+
+    Returns:
+    --------
+    dtypes: dict or defaultdict
+        Column name -> dtype. Unknown columns are read as strings.
+    """
+    dtypes = defaultdict(lambda: str)
+    dtypes.update({col: "float64" for col in NUMERIC_COLUMNS})
+    dtypes.update({col: "category" for col in CATEGORY_COLUMNS})
+    if columns is None:
+        return dtypes
+    return {col: dtypes[col] for col in columns}
+
+
+def _filter_chunk(chunk, filters):
+    """Keep the rows of a chunk matching all the filters."""
+    mask = pd.Series(True, index=chunk.index)
+    for col, value in filters.items():
+        mask &= chunk[col] == value
+    return chunk[mask]
+
+
+def _concat(frames):
+    """Concatenate frames, keeping the category columns as categories."""
+    df = pd.concat(frames, ignore_index=True)
+    # Frames have different categories, which concat turns into strings
+    return df.astype({
+        col: "category" for col in CATEGORY_COLUMNS if col in df.columns
+        })
+
+
+def get_schema(columns):
+    """
+    Return the Parquet schema of DVF columns, from their declared types.
+
+    The schema does not depend on the values, so that all the chunks of a
+    file have the same one (a column that is empty in the first chunk is
+    still a string column).
+    """
+    # Categories differ between chunks, so store them all with the same
+    # dictionary type
+    types = {
+        "float64": pa.float64(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+    }
+    dtypes = get_dtypes()
+    return pa.schema([
+        pa.field(col, types.get(dtypes[col], pa.string())) for col in columns
+        ])
+
+
+def _write_parquet(chunks, path):
+    """Write DataFrame chunks to a Parquet file, one row group per chunk."""
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                schema = get_schema(chunk.columns)
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                )
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _read_metadata(path):
+    """Return the metadata stored next to a cached file, if any."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_metadata(path, metadata):
+    """Write the metadata atomically (readers never see a partial file)."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    os.replace(tmp, path)
+
+
+def _download(url, metadata):
+    """
+    Download the file, unless the server says our copy is still valid.
+
+    Returns:
+    --------
+    result: tuple or None
+        (headers, path to the downloaded file), or None if the server
+        answered 304 Not Modified.
+    """
+    headers = {}
+    if metadata is not None:
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            with tempfile.NamedTemporaryFile(
+                suffix=".csv.gz", delete=False
+            ) as tmp:
+                shutil.copyfileobj(response, tmp)
+            return response.headers, tmp.name
+    except urllib.error.HTTPError as err:
+        if err.code == 304:
+            return None
+        raise
+
+
+def fetch(year, department, url=None, cache_dir=None,
+          revalidate_after=REVALIDATE_AFTER):
+    """
+    Make sure the local Parquet copy of a DVF file is available and
+    up to date.
+
+    Parameters:
+    -----------
+    year: int
+        The year of the transactions.
+    department: int or str
+        The department code (e.g. 75 for Paris).
+    url: str
+        Where to download the file from. Defaults to data.gouv.fr.
+    cache_dir: str
+        The folder where the Parquet copies are stored.
+    revalidate_after: float
+        Number of seconds during which a local copy is used without
+        asking the server.
+
+    Returns:
+    --------
+    path: str
+        The path to the local Parquet file.
+    """
+    url = url or get_url(year, department)
+    folder = os.path.join(cache_dir or CACHE_DIR, str(year))
+    parquet_path = os.path.join(folder, f"{department}.parquet")
+    metadata_path = os.path.join(folder, f"{department}.json")
+
+    metadata = _read_metadata(metadata_path)
+    if metadata is not None and (
+        metadata.get("url") != url
+        or metadata.get("schema") != SCHEMA_VERSION
+        or not os.path.exists(parquet_path)
+    ):
+        metadata = None
+
+    if metadata is not None and \
+            time.time() - metadata["checked"] < revalidate_after:
+        return parquet_path
+
+    try:
+        result = _download(url, metadata)
+    except urllib.error.URLError:
+        # Work offline with the copy we have, if any
+        if metadata is None:
+            raise
+        return parquet_path
+
+    if result is None:
+        metadata["checked"] = time.time()
+    else:
+        headers, csv_path = result
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        os.close(fd)
+        try:
+            chunks = pd.read_csv(
+                csv_path,
+                compression="gzip",
+                dtype=get_dtypes(),
+                chunksize=CHUNK_SIZE
+                )
+            _write_parquet(chunks, tmp)
+            os.replace(tmp, parquet_path)
+        finally:
+            os.remove(csv_path)
+            # Only left if the file could not be converted
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        metadata = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "checked": time.time(),
+            "schema": SCHEMA_VERSION,
+        }
+
+    _write_metadata(metadata_path, metadata)
+    return parquet_path
+
+
+def load_dvf(year, department, columns=None, filters=None, url=None,
+             cache_dir=None):
+    """
+    Return the DVF data for the given year and department.
+
+    Only the requested columns are read from the Parquet file, and the
+    filters are applied while reading, one row group at a time.
+    """
+    path = fetch(year, department, url, cache_dir)
+    if filters:
+        filters = [(col, "==", value) for col, value in filters.items()]
+    return pd.read_parquet(path, columns=columns, filters=filters or None)
+
+
+def read_dvf(file, columns=None, filters=None):
+    """
+    Drop-in replacement for pd.read_csv on a DVF file.
+
+    URLs following the data.gouv.fr layout
+    (".../{year}/departements/{department}.csv.gz") go through the
+    local cache. Anything else (e.g. a local file) is read directly.
+
+    Parameters:
+    -----------
+    file: str
+        The path or URL to the CSV file containing the data.
+    columns: list
+        The columns to read. Defaults to all of them.
+    filters: dict
+        Column -> value. Only the rows where every column is equal to its
+        value are kept. Filtering is done chunk by chunk.
+
+    Returns:
+    --------
+    df: pd.DataFrame
+        The raw data.
+    """
+    match = URL_PATTERN.search(file)
+    if match and file.startswith(("http://", "https://")):
+        year, department = match.groups()
+        return load_dvf(year, department, columns, filters, url=file)
+
+    filters = filters or {}
+    usecols = None
+    if columns is not None:
+        usecols = columns + [col for col in filters if col not in columns]
+    chunks = pd.read_csv(
+        file,
+        compression="gzip",
+        usecols=usecols,
+        dtype=get_dtypes(usecols),
+        chunksize=CHUNK_SIZE
+        )
+    df = _concat([_filter_chunk(chunk, filters) for chunk in chunks])
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def get_version(file):
+    """
+    Return a value that changes whenever the data of a DVF file changes.
+
+    Add it to the keys of the caches computed from the data (e.g. row
+    positions), so that they are not reused once a newer version of the
+    file is downloaded. It brings the local copy up to date like the
+    loaders do, so it matches a read made just before or after it.
+
+    Returns:
+    --------
+    version: float or None
+        The modification time of the local Parquet copy for the URLs
+        read through the cache (see read_dvf), of the file itself for
+        local files, and None for other URLs.
+    """
+    if file.startswith(("http://", "https://")):
+        match = URL_PATTERN.search(file)
+        if not match:
+            return None
+        year, department = match.groups()
+        file = fetch(year, department, url=file)
+    return os.path.getmtime(file)
+
+
+def load_many(years, departments, columns=None, filters=None,
+              base_url=BASE_URL, cache_dir=None, max_workers=MAX_WORKERS):
+    """
+    Load the DVF data for several years and departments.
+
+    The files are downloaded and read in parallel, so the total time is
+    close to the time of the slowest file rather than the sum of all.
+
+    Parameters:
+    -----------
+    years: list
+        The years to load.
+    departments: list
+        The departments to load (every year is loaded for each of them).
+    columns: list
+        The columns to read. Defaults to all of them.
+    filters: dict
+        Column -> value, see read_dvf.
+    base_url: str
+        Where to download the files from. Defaults to data.gouv.fr.
+    cache_dir: str
+        The folder where the Parquet copies are stored.
+    max_workers: int
+        The number of files loaded at the same time.
+
+    Returns:
+    --------
+    df: pd.DataFrame
+        The data of all the files, with "year" and "department" columns
+        telling which file each row comes from.
+    """
+    partitions = [(year, dep) for year in years for dep in departments]
+
+    def load(partition):
+        year, department = partition
+        df = load_dvf(
+            year,
+            department,
+            columns,
+            filters,
+            url=get_url(year, department, base_url),
+            cache_dir=cache_dir
+            )
+        df["year"] = year
+        df["department"] = department
+        return df
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(load, partitions))
+    return _concat(frames)
@@ -0,0 +1,31 @@
+"""
+Shared fixtures of the tests.
+
+The apps import their modules from their own folder, so the tests add
+those folders to the path like benchmarks/run.py does.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    ROOT,
+    os.path.join(ROOT, "benchmarks"),
+    os.path.join(ROOT, "3_dash"),
+    os.path.join(ROOT, "2_streamlit", "1_real_estate"),
+    os.path.join(ROOT, "2_streamlit", "2_real_estate_comparables"),
+    os.path.join(ROOT, "2_streamlit", "3_gdelt"),
+]
+
+from synthetic_dvf import generate  # noqa: E402
+
+ROWS = 50_000  # Rows of the synthetic DVF file
+
+
+@pytest.fixture(scope="session")
+def dvf_file(tmp_path_factory):
+    """A synthetic DVF file (see benchmarks/synthetic_dvf.py)."""
+    return generate(ROWS, str(tmp_path_factory.mktemp("dvf") / "75.csv.gz"))
@@ -0,0 +1,59 @@
+"""
+Tests of the functions shared by the dashboards (3_dash/common.py).
+"""
+
+import pandas as pd
+import pytest
+
+from common import query_table
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'id_mutation': ["2022-1", "2022-2", "2022-10", "2022-4"],
+        'date_mutation': ["2022-01-05", "2022-02-10", "2022-02-20",
+                          "2022-03-01"],
+        'valeur_fonciere': [150_000.0, 520_000.0, 85_000.0, 300_000.0],
+        'type_local': pd.Categorical(
+            ["Maison", "Appartement", "Appartement", "Maison"]
+            ),
+        })
+
+
+def get_ids(df, filter_query):
+    data, _ = query_table(df, page_size=10, filter_query=filter_query)
+    return [row['id_mutation'] for row in data]
+
+
+@pytest.mark.parametrize("filter_query, expected", [
+    ("{valeur_fonciere} > 200000", ["2022-2", "2022-4"]),
+    ("{valeur_fonciere} s< '100000'", ["2022-10"]),
+    ("{valeur_fonciere} contains 5", ["2022-1", "2022-2", "2022-10"]),
+    ("{type_local} = Maison", ["2022-1", "2022-4"]),
+    ("{id_mutation} = 2022-2", ["2022-2"]),
+    ("{id_mutation} < 2022-2", ["2022-1", "2022-10"]),
+    ("{date_mutation} datestartswith 2022-02", ["2022-2", "2022-10"]),
+    ("{type_local} contains app && {valeur_fonciere} >= 100000",
+     ["2022-2"]),
+    ])
+def test_filters(df, filter_query, expected):
+    assert get_ids(df, filter_query) == expected
+
+
+@pytest.mark.parametrize("filter_query", [
+    "{valeur_fonciere} > abc",
+    "{unknown} = 5",
+    "garbage",
+    ])
+def test_invalid_filters_are_ignored(df, filter_query):
+    """Conditions that do not fit the data are ignored, not raised."""
+    assert len(get_ids(df, filter_query)) == len(df)
+
+
+def test_sort_and_page(df):
+    sort_by = [{'column_id': 'valeur_fonciere', 'direction': 'desc'}]
+    data, page_count = query_table(df, page_current=1, page_size=3,
+                                   sort_by=sort_by)
+    assert page_count == 2
+    assert [row['valeur_fonciere'] for row in data] == [85_000.0]
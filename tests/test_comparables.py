@@ -0,0 +1,83 @@
+"""
+Tests of the comparables model and its backtest
+(2_streamlit/2_real_estate_comparables).
+"""
+
+import geopy.distance as gd
+import numpy as np
+import pandas as pd
+import pytest
+
+import comparables
+from backtest import backtest, estimate_prices, get_errors
+from comparables import get_distances
+
+# Bounding box of mainland France (latitude, longitude)
+FRANCE = ((42.3, -4.8), (51.1, 8.2))
+TOLERANCE = 0.004  # Relative error allowed, see get_distances
+
+
+def test_distances_match_geopy():
+    """The haversine distance is close to geopy's geodesic distance."""
+    rng = np.random.default_rng(0)
+    latitude = rng.uniform(FRANCE[0][0], FRANCE[1][0], 500)
+    longitude = rng.uniform(FRANCE[0][1], FRANCE[1][1], 500)
+    # Paris, and a point far south-west of it
+    for lat0, lon0 in [(48.8566, 2.3522), (43.2965, -1.4747)]:
+        distances = get_distances(latitude, longitude, lat0, lon0)
+        expected = np.array([
+            gd.distance((lat, lon), (lat0, lon0)).m
+            for lat, lon in zip(latitude, longitude)
+            ])
+        # Nearby points (under 1 km) are compared in absolute terms
+        error = np.abs(distances - expected) / np.maximum(expected, 1000)
+        assert error.max() < TOLERANCE
+
+
+def test_distances_zero():
+    """A point is at distance 0 from itself."""
+    assert get_distances([48.85], [2.35], 48.85, 2.35)[0] == 0
+
+
+@pytest.fixture(scope="module")
+def model(dvf_file):
+    """The training set, test set, features and index of a file."""
+    train, test = comparables.prepare_data(dvf_file)
+    features = comparables.get_features(train)
+    return train, test.head(300), features, comparables.build_index(features)
+
+
+def test_estimate_prices_skips_missing():
+    """Neighbours without a price are skipped, none at all gives NaN."""
+    train = pd.DataFrame({'valeur_fonciere': [100.0, np.nan, 300.0, np.nan]})
+    positions = np.array([[0, 1, 2], [1, 3, 0]])
+    estimates = estimate_prices(train, positions, k=2)
+    assert estimates[0] == 100.0
+    assert np.isnan(estimates[1])
+    assert estimate_prices(train, positions, k=3)[1] == 100.0
+
+
+def test_errors_ignore_unpriced():
+    """Properties without an estimate or an actual price are left out."""
+    actual = np.array([100.0, 200.0, np.nan, 400.0])
+    estimates = np.array([110.0, np.nan, 300.0, 300.0])
+    errors = get_errors(actual, estimates)
+    assert errors['mae'] == pytest.approx(55.0)
+    assert errors['mape'] == pytest.approx(100 * (0.1 + 0.25) / 2)
+
+
+def test_backtest_matches_app(model):
+    """With equal weights, the backtest values like find_comparables."""
+    train, test, features, index = model
+    k = 5
+    results = backtest(train, test, features, index, ks=[k], max_workers=2)
+
+    estimates = np.array([
+        comparables.find_comparables(
+            train, features, index, test.iloc[[i]], k
+            ).valeur_fonciere.mean()
+        for i in range(len(test))
+        ])
+    expected = get_errors(test.valeur_fonciere.values, estimates)
+    assert results.loc[0, 'mae'] == pytest.approx(expected['mae'])
+    assert results.loc[0, 'mape'] == pytest.approx(expected['mape'])
@@ -0,0 +1,124 @@
+"""
+Tests of the DVF loaders (dvf.py).
+"""
+
+import functools
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import common
+import dvf
+from dvf import _write_parquet, get_version, read_dvf
+from synthetic_dvf import generate
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serve files without logging every request."""
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def dvf_server(tmp_path):
+    """A local server of DVF files, laid out like data.gouv.fr."""
+    folder = tmp_path / "files"
+    folder.mkdir()
+    handler = functools.partial(QuietHandler, directory=str(folder))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield folder, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def get_memory(df):
+    """Return the memory used by a frame, in MB."""
+    return df.memory_usage(deep=True).sum() / 1024**2
+
+
+def test_memory(dvf_file):
+    """The columns and types of the schema use much less memory."""
+    # What the apps did before: parse every column, guessing the types
+    before = pd.read_csv(dvf_file, compression="gzip", low_memory=False)
+    after = read_dvf(dvf_file, columns=common.COLUMNS)
+
+    print(f"\nMemory of {len(before):,} rows: {get_memory(before):.1f} MB "
+          f"with all the columns, {get_memory(after):.1f} MB "
+          f"with the schema and the columns of the Dash apps")
+    assert len(after) == len(before)
+    assert get_memory(after) < get_memory(before) / 3
+
+
+def test_types(dvf_file):
+    """The declared types are used, whatever the values of the file."""
+    df = read_dvf(dvf_file)
+    assert df["valeur_fonciere"].dtype == "float64"
+    assert df["code_postal"].dtype == "float64"
+    assert isinstance(df["type_local"].dtype, pd.CategoricalDtype)
+
+
+def test_write_parquet_empty_first_chunk(tmp_path):
+    """A string column empty in the first chunk is not typed as null."""
+    chunks = [
+        pd.DataFrame({
+            "numero_volume": pd.Series([None, None], dtype=object),
+            "valeur_fonciere": [100_000.0, None],
+            "type_local": pd.Categorical(["Maison", None]),
+            }),
+        pd.DataFrame({
+            "numero_volume": pd.Series(["12", None], dtype=object),
+            "valeur_fonciere": [250_000.0, 80_000.0],
+            "type_local": pd.Categorical(["Appartement", "Maison"]),
+            }),
+        ]
+    path = tmp_path / "75.parquet"
+    _write_parquet(chunks, path)
+
+    df = pd.read_parquet(path)
+    assert df["numero_volume"].tolist()[2] == "12"
+    assert df["valeur_fonciere"].dtype == "float64"
+    assert isinstance(df["type_local"].dtype, pd.CategoricalDtype)
+    assert df["type_local"].isna().tolist() == [False, True, False, False]
+
+
+def test_version_changes_with_file(dvf_server, tmp_path, monkeypatch):
+    """The version changes when the file is downloaded again."""
+    folder, base_url = dvf_server
+    monkeypatch.setattr(dvf, "CACHE_DIR", str(tmp_path / "cache"))
+    path = folder / "2022" / "departements" / "75.csv.gz"
+    url = dvf.get_url(2022, 75, base_url)
+
+    generate(1000, str(path), seed=1)
+    version = get_version(url)
+    assert len(read_dvf(url)) == 1000
+    assert get_version(url) == version
+
+    # A new file on the server, checked a day later
+    generate(500, str(path), seed=2)
+    modified = path.stat().st_mtime + 60
+    os.utime(path, (modified, modified))
+    now = time.time() + dvf.REVALIDATE_AFTER
+    monkeypatch.setattr(dvf.time, "time", lambda: now)
+    new_version = get_version(url)
+    assert new_version != version
+    assert len(read_dvf(url)) == 500
+
+
+def test_corrupt_download_leaves_no_file(dvf_server, tmp_path, monkeypatch):
+    """A file that cannot be converted leaves nothing in the cache."""
+    folder, base_url = dvf_server
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(dvf, "CACHE_DIR", str(cache_dir))
+    path = folder / "2022" / "departements" / "75.csv.gz"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"not gzip")
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            read_dvf(dvf.get_url(2022, 75, base_url))
+    assert [p.name for p in cache_dir.rglob("*") if p.is_file()] == []
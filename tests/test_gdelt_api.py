@@ -0,0 +1,397 @@
+"""
+Tests of the GDELT helpers (2_streamlit/3_gdelt/gdelt_api.py), against
+local stand-in servers with artificial latency.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import gdelt_api
+
+LATENCY = 0.2  # Seconds taken by the stand-in servers to answer
+DAY = datetime(2019, 9, 20)  # Day of the articles of the GDELT stand-in
+
+
+class SentimentHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in of the sentiment API: GET ?text=...&lang=... answers
+    {"Sentiment": ...} after LATENCY seconds ("POSITIVE" if the text
+    contains "good", "NEGATIVE" otherwise).
+
+    POST {"texts": [...], "lang": ...} answers {"Sentiments": [...]}
+    after LATENCY seconds too, or 405 (Method Not Allowed) if
+    server.batching is False.
+    """
+
+    # Keep the connections open, like the real API
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        self.server.requests.append(params["text"][0])
+        time.sleep(LATENCY)
+        sentiment = "POSITIVE" if "good" in params["text"][0] else "NEGATIVE"
+        self.send_json({"Sentiment": sentiment})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if not self.server.batching:
+            self.send_json({}, status=405)
+            return
+        texts = json.loads(body)["texts"]
+        self.server.batches.append(texts)
+        time.sleep(LATENCY)
+        self.send_json({"Sentiments": [
+            "POSITIVE" if "good" in text else "NEGATIVE" for text in texts
+            ]})
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class GdeltHandler(SentimentHandler):
+    """
+    A stand-in of the GDELT doc API, answering after LATENCY seconds:
+    there is an article every 5 minutes of 2019-09-20, and one shared by
+    all the answers (at their end). At most maxrecords articles are
+    answered. The windows starting at a time in server.failing answer 429
+    (Too Many Requests) that many times.
+    """
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        start = params["startdatetime"][0]
+        end = params["enddatetime"][0]
+        with self.server.lock:
+            self.server.requests.append((start, end))
+            self.server.running += 1
+            self.server.max_running = max(
+                self.server.max_running, self.server.running
+                )
+        time.sleep(LATENCY)
+        with self.server.lock:
+            self.server.running -= 1
+            if self.server.failing.get(start, 0) > 0:
+                self.server.failing[start] -= 1
+                self.send_json({}, status=429)
+                return
+        times = [DAY + i * timedelta(minutes=5) for i in range(24 * 12)]
+        articles = [
+            {"url": f"https://news.example/{t:%H%M}", "title": f"{t:%H:%M}"}
+            for t in times
+            if start <= t.strftime(gdelt_api.DATETIME_FORMAT) < end
+            ]
+        articles.append({"url": "https://news.example/shared",
+                         "title": "shared"})
+        self.send_json(
+            {"articles": articles[:int(params["maxrecords"][0])]}
+            )
+
+
+def serve(handler):
+    """Start a stand-in server, returning it and its URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.requests = []
+    server.batches = []
+    server.batching = True
+    server.connections = 0
+    server.lock = threading.Lock()
+    server.running = server.max_running = 0
+    server.failing = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Each test starts without cached answers."""
+    gdelt_api._articles_cache.clear()
+    gdelt_api._sentiment_cache.clear()
+    gdelt_api._no_batching.clear()
+
+
+@pytest.fixture
+def sentiment_server():
+    server, url = serve(SentimentHandler)
+    yield server, url
+    server.shutdown()
+
+
+def test_sentiments_concurrent_and_ordered(sentiment_server):
+    """The titles are scored concurrently, and answered in their order."""
+    server, url = sentiment_server
+    texts = [f"title {i} is {'good' if i % 3 else 'bad'}" for i in range(40)]
+
+    start = time.perf_counter()
+    sentiments = gdelt_api.get_sentiments(url, texts)
+    duration = time.perf_counter() - start
+
+    sequential = len(texts) * LATENCY
+    print(f"\n{len(texts)} titles scored in {duration:.2f} s "
+          f"({sequential:.2f} s one after the other)")
+    assert sentiments == [
+        "POSITIVE" if "good" in text else "NEGATIVE" for text in texts
+        ]
+    assert sorted(server.requests) == sorted(texts)
+    # MAX_WORKERS requests at a time, over connections kept open
+    assert duration < 2 * sequential / gdelt_api.MAX_WORKERS
+    assert server.connections <= gdelt_api.MAX_WORKERS
+
+
+def test_sentiments_cached(sentiment_server):
+    """A title already scored is not requested again."""
+    server, url = sentiment_server
+    gdelt_api.get_sentiments(url, ["good news", "bad news"])
+    assert gdelt_api.get_sentiments(url, ["bad news", "good news"]) == [
+        "NEGATIVE", "POSITIVE"
+        ]
+    assert len(server.requests) == 2
+
+
+def test_sentiments_batched(sentiment_server):
+    """Batches take fewer requests and less time than single titles."""
+    server, url = sentiment_server
+    texts = [f"title {i} is {'good' if i % 3 else 'bad'}" for i in range(100)]
+    expected = ["POSITIVE" if "good" in text else "NEGATIVE" for text in texts]
+
+    start = time.perf_counter()
+    assert gdelt_api.get_sentiments(url, texts) == expected
+    single = time.perf_counter() - start
+    gdelt_api._sentiment_cache.clear()
+    start = time.perf_counter()
+    assert gdelt_api.get_sentiments(url, texts, batch_size=25) == expected
+    batched = time.perf_counter() - start
+
+    print(f"\n{len(texts)} titles scored in {single:.2f} s one by one, "
+          f"{batched:.2f} s by batches")
+    assert len(server.requests) == len(texts)
+    assert [len(batch) for batch in server.batches] == [25] * 4
+    assert batched < single / 2
+
+
+def test_sentiments_batch_fallback(sentiment_server):
+    """An API refusing batches gets the titles one by one, from then on."""
+    server, url = sentiment_server
+    server.batching = False
+    texts = ["bad news", "good news", "bad news", "more good news"]
+    assert gdelt_api.get_sentiments(url, texts, batch_size=2) == [
+        "NEGATIVE", "POSITIVE", "NEGATIVE", "POSITIVE"
+        ]
+    assert url in gdelt_api._no_batching
+    assert sorted(server.requests) == sorted(set(texts))
+    # The next titles are not posted at all
+    server.batching = True
+    gdelt_api.get_sentiments(url, ["other news"], batch_size=2)
+    assert server.batches == []
+    assert server.requests[-1] == "other news"
+
+
+@pytest.mark.parametrize("batch_size, batching", [
+    (None, True), (10, True), (10, False)
+    ])
+def test_iter_sentiments(sentiment_server, monkeypatch, batch_size,
+                         batching):
+    """
+    The first sentiment arrives after about one round-trip, each position
+    once, with a single pool of threads (also when batches are refused).
+    """
+    server, url = sentiment_server
+    server.batching = batching
+    pools = []
+
+    class Pool(ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+
+    monkeypatch.setattr(gdelt_api, "ThreadPoolExecutor", Pool)
+    texts = [f"title {i} is {'good' if i % 3 else 'bad'}" for i in range(40)]
+
+    start = time.perf_counter()
+    results = []
+    for position, sentiment in gdelt_api.iter_sentiments(
+            url, texts, batch_size=batch_size):
+        if not results:
+            first = time.perf_counter() - start
+        results.append((position, sentiment))
+
+    assert first < 2 * LATENCY
+    assert sorted(results) == [
+        (i, "POSITIVE" if "good" in text else "NEGATIVE")
+        for i, text in enumerate(texts)
+        ]
+    assert len(pools) == 1
+
+
+def test_sentiment_unknown():
+    """A sentiment API that does not answer gives UNKNOWN."""
+    assert gdelt_api.get_sentiments("http://127.0.0.1:9/", ["news"]) == [
+        gdelt_api.UNKNOWN
+        ]
+
+
+@pytest.fixture
+def gdelt_server():
+    server, url = serve(GdeltHandler)
+    yield server, url
+    server.shutdown()
+
+
+def test_search_articles_single_flight(gdelt_server):
+    """Concurrent searches of the same window send one request."""
+    server, url = gdelt_server
+    barrier = threading.Barrier(8)
+    results = []
+
+    def search():
+        barrier.wait()
+        results.append(gdelt_api.search_articles("news", api=url))
+
+    threads = [threading.Thread(target=search) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.requests == [(gdelt_api.START, gdelt_api.END)]
+    assert len(results) == 8
+    assert all(result is results[0] for result in results)
+
+
+def test_search_articles_expire(gdelt_server, monkeypatch):
+    """A cached window is searched again after ttl seconds."""
+    server, url = gdelt_server
+    monkeypatch.setattr(
+        gdelt_api, "_articles_cache", gdelt_api.TTLCache(ttl=0.5)
+        )
+    gdelt_api.search_articles("news", api=url)
+    gdelt_api.search_articles("news", api=url)
+    assert len(server.requests) == 1
+    time.sleep(0.6)
+    gdelt_api.search_articles("news", api=url)
+    assert len(server.requests) == 2
+
+
+def test_search_articles_evict(gdelt_server, monkeypatch):
+    """Past max_size, the least recently used window is dropped."""
+    server, url = gdelt_server
+    monkeypatch.setattr(
+        gdelt_api, "_articles_cache", gdelt_api.TTLCache(max_size=2)
+        )
+
+    def search(hour):
+        start = f"20190920{hour:02}0000"
+        gdelt_api.search_articles("news", start=start, end=start, api=url)
+
+    # 1 is used again after 2, so 2 is dropped when 3 is added
+    for hour in [1, 2, 1, 3, 1, 2]:
+        search(hour)
+    assert [int(start[8:10]) for start, _ in server.requests] == [
+        1, 2, 3, 2
+        ]
+
+
+def test_search_articles_failure_not_cached(gdelt_server):
+    """A failed search is not cached: the next one is sent again."""
+    server, url = gdelt_server
+    server.failing = {gdelt_api.START: 1}
+    with pytest.raises(gdelt_api.requests.HTTPError):
+        gdelt_api.search_articles("news", api=url)
+    assert len(gdelt_api.search_articles("news", api=url)) == 12 + 1
+    assert len(server.requests) == 2
+
+
+def search(url, start, end):
+    """Search a range of 2019-09-20 (hours) with the stand-in."""
+    return gdelt_api.search_range(
+        "news", DAY + timedelta(hours=start), DAY + timedelta(hours=end),
+        api=url, retry_delay=0
+        )
+
+
+def test_search_range_one_window(gdelt_server):
+    """A range with fewer than MAX_RECORDS articles takes one call."""
+    server, url = gdelt_server
+    articles, failed = search(url, 13.5, 14.5)
+    assert failed == []
+    assert server.requests == [("20190920133000", "20190920143000")]
+    assert [a["title"] for a in articles[:2]] == ["13:30", "13:35"]
+    assert len(articles) == 12 + 1
+
+
+def test_search_range_splits_full_windows(gdelt_server, monkeypatch):
+    """
+    The windows that return MAX_RECORDS articles are split until none
+    is missing, searched a few at a time and merged in order.
+    """
+    server, url = gdelt_server
+    monkeypatch.setattr(gdelt_api, "MAX_RECORDS", 10)
+    start = time.perf_counter()
+    articles, failed = search(url, 8, 12)
+    duration = time.perf_counter() - start
+
+    # 4 h, 2 h and 1 h windows have more than 10 articles, not 30 min
+    print(f"\n{len(server.requests)} windows searched in {duration:.2f} s")
+    assert failed == []
+    assert len(server.requests) == 1 + 2 + 4 + 8
+    titles = [a["title"] for a in articles]
+    assert titles.count("shared") == 1
+    titles.remove("shared")
+    assert titles == [
+        f"{8 + i // 12:02}:{i % 12 * 5:02}" for i in range(4 * 12)
+        ]
+    assert server.max_running <= gdelt_api.MAX_SEARCHES
+    assert duration < len(server.requests) * LATENCY / 2
+
+
+def test_search_range_min_window(gdelt_server, monkeypatch):
+    """The windows shorter than twice MIN_WINDOW are not split."""
+    server, url = gdelt_server
+    monkeypatch.setattr(gdelt_api, "MAX_RECORDS", 2)
+    articles, failed = search(url, 13.5, 14)
+    assert failed == []
+    assert len(server.requests) == 1 + 2
+    # The halves still have more articles than the 2 answered
+    assert len(articles) == 2 * 2
+
+
+def test_search_range_retries(gdelt_server):
+    """A window refused once is searched again."""
+    server, url = gdelt_server
+    server.failing = {"20190920133000": 1}
+    articles, failed = search(url, 13.5, 14.5)
+    assert failed == []
+    assert len(articles) == 12 + 1
+    assert len(server.requests) == 2
+
+
+def test_search_range_skips_failed_windows(gdelt_server, monkeypatch):
+    """A window that keeps failing is skipped and reported."""
+    server, url = gdelt_server
+    monkeypatch.setattr(gdelt_api, "MAX_RECORDS", 10)
+    server.failing = {"20190920090000": 2}
+    articles, failed = search(url, 8, 10)
+    assert failed == [("20190920090000", "20190920100000")]
+    assert len(articles) == 12 + 1
+    # Failures are not cached: the next search tries them again
+    articles, failed = search(url, 8, 10)
+    assert failed == []
+    assert len(articles) == 2 * 12 + 1
@@ -0,0 +1,115 @@
+"""
+Tests of the sentiment backends (2_streamlit/3_gdelt/sentiment.py).
+
+The local backend is tested without network access, the remote one
+against the stand-in of the sentiment API of test_gdelt_api.
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+import gdelt_api
+import sentiment
+from test_gdelt_api import SentimentHandler, serve
+
+HEADLINES = os.path.join(os.path.dirname(__file__), "data", "headlines.csv")
+TITLES = [f"Title {i}: shares soar after a record quarter" for i in range(50)]
+TITLES += [f"Title {i}: markets slump as the crisis deepens" for i in range(50)]
+
+
+@pytest.fixture
+def trainings(monkeypatch):
+    """Count the models trained, starting without a local model."""
+    calls = []
+    train_model = sentiment.train_model
+
+    def counted(*args):
+        calls.append(args)
+        return train_model(*args)
+
+    monkeypatch.setattr(sentiment, "train_model", counted)
+    monkeypatch.setattr(sentiment, "_model", None)
+    return calls
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Make any connection fail."""
+    def connect(*args):
+        raise OSError("No network in this test")
+
+    monkeypatch.setattr(socket.socket, "connect", connect)
+
+
+def test_local_offline(trainings, offline):
+    """The local model scores 100 titles at once, in milliseconds."""
+    backend = sentiment.LocalSentiment()
+    backend.get_sentiments(["warm up"])
+    start = time.perf_counter()
+    sentiments = backend.get_sentiments(TITLES)
+    duration = time.perf_counter() - start
+
+    print(f"\n{len(TITLES)} titles scored in {duration * 1000:.1f} ms")
+    assert sentiments == ["POSITIVE"] * 50 + ["NEGATIVE"] * 50
+    assert duration < 0.1
+
+
+def test_local_model_built_once(trainings):
+    """Concurrent first uses build one model, kept for the process."""
+    barrier = threading.Barrier(8)
+    models = []
+
+    def load():
+        barrier.wait()
+        models.append(sentiment.get_model())
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sentiment.LocalSentiment().get_sentiments(TITLES)
+    assert len(trainings) == 1
+    assert all(model is sentiment.get_model() for model in models)
+
+
+def test_same_shapes(trainings):
+    """Both backends return one sentiment per title, and each position."""
+    server, url = serve(SentimentHandler)
+    gdelt_api._sentiment_cache.clear()
+    titles = TITLES[::10]
+    try:
+        for backend in [sentiment.LocalSentiment(),
+                        sentiment.RemoteSentiment(url, batch_size=4)]:
+            sentiments = backend.get_sentiments(titles)
+            assert isinstance(sentiments, list)
+            assert len(sentiments) == len(titles)
+            assert all(isinstance(s, str) for s in sentiments)
+            assert sorted(backend.iter_sentiments(titles)) == list(
+                enumerate(sentiments)
+                )
+            assert backend.get_sentiments([]) == []
+    finally:
+        server.shutdown()
+
+
+def test_trained_model(trainings, monkeypatch, tmp_path):
+    """A model trained on labelled headlines is loaded from its file."""
+    path = str(tmp_path / "model.joblib")
+    monkeypatch.setattr(sys, "argv", ["sentiment.py", HEADLINES, path])
+    sentiment.main()
+    monkeypatch.setattr(sentiment, "MODEL_FILE", path)
+    monkeypatch.setattr(sentiment, "_model", None)
+
+    sentiments = sentiment.LocalSentiment().get_sentiments([
+        "Team wins a record award",
+        "Storm kills dozens and floods destroy homes",
+        ])
+    assert sentiments == ["POSITIVE", "NEGATIVE"]
+    # Only the model of the file, no keyword heuristic
+    assert len(trainings) == 1
@@ -0,0 +1,71 @@
+"""
+Tests of the quantile sketch (2_streamlit/1_real_estate/sketch.py).
+"""
+
+import numpy as np
+import pytest
+
+from sketch import DEFAULT_K, QuantileSketch, merge_sketches
+
+# Rank error allowed, as a fraction of the number of values (see the
+# docstring of sketch.py: about 1.7 / k)
+EPSILON = 1.7 / DEFAULT_K
+QUANTILES = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+
+
+def get_partitions(seed=0):
+    """Prices of several (year, department) files of different sizes."""
+    rng = np.random.default_rng(seed)
+    return [
+        np.round(rng.lognormal(mean, 0.6, size), -2)
+        for mean, size in [(12.9, 200_000), (13.2, 50_000), (12.5, 120_000),
+                           (13.5, 5_000)]
+        ]
+
+
+def get_rank_error(values, value, q):
+    """Return how far value is from the q-quantile of values, in rank."""
+    values = np.sort(values)
+    # Values equal to value could be at any of their ranks
+    low = np.searchsorted(values, value, side="left")
+    high = np.searchsorted(values, value, side="right")
+    target = q * len(values)
+    return max(0, low - target, target - high) / len(values)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_merged_error_bound(seed):
+    """The quantiles of merged sketches are within the error bound."""
+    partitions = get_partitions(seed)
+    sketch = merge_sketches(
+        QuantileSketch.from_values(values, seed=seed)
+        for values in partitions
+        )
+    values = np.concatenate(partitions)
+    assert sketch.n == len(values)
+    for q in QUANTILES:
+        error = get_rank_error(values, sketch.quantile(q), q)
+        assert error <= EPSILON, (q, error)
+    # Compared to the exact value too
+    assert sketch.median() == pytest.approx(np.quantile(values, 0.5),
+                                            rel=0.02)
+
+
+def test_merge_is_deterministic():
+    """Merging the same sketches always gives the same median."""
+    sketches = [QuantileSketch.from_values(v) for v in get_partitions()]
+    medians = {merge_sketches(sketches).median() for _ in range(10)}
+    assert len(medians) == 1
+
+
+def test_merge_keeps_inputs():
+    """Merging does not modify the (cached) sketches."""
+    a, b = (QuantileSketch.from_values(v) for v in get_partitions()[:2])
+    levels = [level.copy() for level in a.levels]
+    a.merge(b)
+    assert all(np.array_equal(x, y) for x, y in zip(levels, a.levels))
+
+
+def test_empty():
+    assert np.isnan(merge_sketches([]).median())
+    assert QuantileSketch.from_values([np.nan, 1.0]).median() == 1.0